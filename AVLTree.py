@@ -1,7 +1,28 @@
 
 """A class represnting a node in an AVL tree"""
+import asyncio
+import mmap
+import os
+import pickle
+import random
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import cmp_to_key
 from inspect import stack
 
+try:
+    import numpy
+except ImportError:  # optional, search_many falls back to bisect on a list
+    numpy = None
+
 class AVLNode(object):
     """Constructor, you are allowed to add more fields.
 
@@ -11,6 +32,10 @@ class AVLNode(object):
     @param value: data of your node
     """
 
+    # fixed attribute layout instead of a per-node __dict__, a new field must be listed here
+    # agg is only set while the tree has a monoid, see AVLTree.enable_aggregate
+    __slots__ = ('key', 'value', 'left', 'right', 'parent', 'height', 'size', 'isVirtual', 'agg')
+
     def __init__(self, key, value):
         self.key = key
         self.value = value
@@ -18,12 +43,17 @@ class AVLNode(object):
         self.right = None
         self.parent = None
         self.height = -1
+        self.size = 1  # number of real nodes in the subtree rooted at self, 0 for virtual
         self.isVirtual = False
 
     def updateHeight(self):
         # time complexity O(1)
         self.height = (max(self.left.height, self.right.height)) + 1
 
+    def updateSize(self):
+        # time complexity O(1)
+        self.size = self.left.size + self.right.size + 1
+
     def balanceFactor(self):
         # time complexity O(1)
 
@@ -73,24 +103,106 @@ A class implementing an AVL tree.
 class AVLTree(object):
     """
     Constructor, you are allowed to add more fields.
+    if sticky, search and finger_search start from the last accessed node (see search_from).
+    mode decides what inserting a key that is already in the dictionary does:
+    None - not allowed (the precondition of insert), no check is made,
+    "upsert" - the value of the existing node is replaced,
+    "multimap" - every node holds a list of the values of its key, the value is appended.
     """
 
-    def __init__(self):
+    # a batch of m items is merged by union (or difference) when m * BULK_RATIO >= size of the tree
+    BULK_RATIO = 8
+    # parallel_* methods fall back to the sequential version below this many items
+    PARALLEL_CUTOFF = 200000
+    # delete_range removes up to this many keys one by one instead of splitting
+    RANGE_DELETE_CUTOFF = 16
+
+    MODES = (None, "upsert", "multimap")
+
+    def __init__(self, sticky=False, mode=None):
+        if mode not in self.MODES:
+            raise ValueError("unknown mode %r" % (mode,))
 
         self.virtual = AVLNode(None, None)
         self.virtual.isVirtual = True
+        self.virtual.size = 0
         self.root = self.virtual
         self.max = None
         self.min = None
         self.Treesize = 0
+        self.sticky = sticky
+        self.mode = mode
+        self.finger = None  # last accessed node when sticky, None when unknown
+        self.cache = None  # key -> node lookup cache, see enable_cache
+        self.stats = None  # AVLStats counters, see enable_stats
+        self.version = 0  # bumped by every change of the keys, see search_many
+        self.flat = None  # (version, keys, nodes, numpy keys, depths) cached by search_many
+        self.monoid = None  # (combine, identity) of the subtree aggregates, see enable_aggregate
 
     def createByRoot(self, rootNode):
     # specific helper function for split
-    ## assumes self is an empty AVL tree, updating only its root to rootNode
+    ## assumes self is an empty AVL tree, updating only its root and size to rootNode
     ## time complexity O(1)
         if(rootNode.is_real_node()):
             self.root = rootNode
             self.root.parent = self.virtual
+            self.Treesize = rootNode.size
+
+    """builds an AVL tree from (key, value) pairs that are already sorted by key
+
+    @type items: iterable
+    @pre: keys are distinct and appear in ascending order
+    @param items: (key, value) pairs to be stored in the tree
+    @rtype: AVLTree
+    @returns: a perfectly balanced AVLTree holding items
+    """
+
+    @classmethod
+    def from_sorted(cls, items):
+        # middle item of every range becomes the subtree root, so each node is created
+        # and linked exactly once with its final height, no rebalancing needed
+        # time complexity O(n)
+        tree = cls()
+        if not isinstance(items, list):
+            items = list(items)
+        if len(items) == 0:  # special case, empty input
+            return tree
+        virtual = tree.virtual
+
+        def buildRec(lo, hi, parent):
+            # inner function building items[lo..hi] under parent, recursion depth O(logn)
+            if lo > hi:
+                return virtual
+            mid = (lo + hi) // 2
+            key, value = items[mid]
+            node = AVLNode(key, value)
+            node.parent = parent
+            node.left = buildRec(lo, mid - 1, node)
+            node.right = buildRec(mid + 1, hi, node)
+            node.updateHeight()
+            node.updateSize()
+            return node
+
+        tree.root = buildRec(0, len(items) - 1, virtual)
+        tree.min = tree.root.findMin()
+        tree.max = tree.root.findMax()
+        tree.Treesize = len(items)
+        return tree
+
+    """builds an AVL tree from (key, value) pairs given in any order
+
+    @type items: iterable
+    @pre: keys are distinct
+    @param items: (key, value) pairs to be stored in the tree
+    @rtype: AVLTree
+    @returns: a perfectly balanced AVLTree holding items
+    """
+
+    @classmethod
+    def from_unsorted(cls, items):
+        # sort by key only (values need not be comparable), then linear build
+        # time complexity O(nlogn)
+        return cls.from_sorted(sorted(items, key=lambda item: item[0]))
 
     """searches for a node in the dictionary corresponding to the key (starting at the root)
 
@@ -103,10 +215,23 @@ class AVLTree(object):
 
     def search(self, key):
         # function search key in the AVL
-        # time complexity O(h) = O(logn)
-        e = 1
-        node = self.root
-        return self.searchFromNode(node, key, e)
+        # time complexity O(h) = O(logn), O(logd) from the sticky finger, O(1) on a cache hit
+        cache = self.cache
+        if cache is not None:
+            node = cache.get(key)
+            if node is not None:  # a hit walks no edge
+                if self.stats is not None:
+                    self.stats.recordSearch(1)
+                return (node, 1)
+        if self.sticky:
+            node, e = self.stickySearch(key)
+        else:
+            node, e = self.searchFromNode(self.root, key, 1)
+        if cache is not None and node is not None:
+            cache.put(key, node)
+        if self.stats is not None:
+            self.stats.recordSearch(e)
+        return (node, e)
 
     def searchFromNode(self, node, key, e):
         ## helper func to combine search from specified Node downwards until reaching key or virtual
@@ -133,17 +258,323 @@ class AVLTree(object):
 
     def finger_search(self, key):
         # search key in AVL tree starting from the maximal node
-        # time complexity O(h) = O(logn) using helper functions
-
+        # time complexity O(h) = O(logn) using helper functions, O(1) on a cache hit
+        cache = self.cache
+        if cache is not None:
+            node = cache.get(key)
+            if node is not None:  # a hit walks no edge
+                if self.stats is not None:
+                    self.stats.recordSearch(1)
+                return (node, 1)
         if (self.root.is_real_node()):
             e = 1
             node = self.max
             node, e = self.fingerDownwardStart(key, e)  # step 1, find spot to start moving downwards
 
-            return self.searchFromNode(node, key, e)  # regular search downwards
+            node, e = self.searchFromNode(node, key, e)  # regular search downwards
+            if node is not None:
+                if self.sticky:
+                    self.finger = node
+                if cache is not None:
+                    cache.put(key, node)
+            if self.stats is not None:
+                self.stats.recordSearch(e)
+            return (node, e)
         else:  # special case, tree is empty
             return (None, 1)
 
+    """searches for a batch of keys at once
+
+    @type keys: numpy.ndarray or sequence
+    @param keys: keys to be searched, in any order
+    @type edges: bool
+    @param edges: also return the edge count of every search
+    @rtype: tuple
+    @returns: (found, values) or (found, values, e) when edges is True, where found[i] tells
+    if keys[i] is in the dictionary, values[i] is its value (None if not found) and e[i] is
+    the e that search would return walking from the root. found and e are numpy arrays for a
+    numpy query and lists otherwise, values is a list.
+    """
+
+    def search_many(self, keys, edges=False):
+        # the tree is flattened into a sorted key list once and kept until the next change,
+        # numpy queries are answered by a vectorized searchsorted, other sequences by bisect,
+        # sorted ones resuming every bisect where the previous key was found
+        # time complexity O(n) to flatten, then O(mlogn), O(mlog(n/m + 1)) for sorted keys
+        flatKeys, nodes, arrayKeys, depths = self.flattened(edges)
+        n = len(nodes)
+        if numpy is not None and isinstance(keys, numpy.ndarray):
+            if arrayKeys is None:
+                arrayKeys = self.flatArray()
+            positions = numpy.searchsorted(arrayKeys, keys)
+            clipped = numpy.minimum(positions, max(n - 1, 0))
+            found = (positions < n) & (arrayKeys[clipped] == keys) if n else numpy.zeros(len(keys), bool)
+            values = [nodes[i].value if hit else None for i, hit in zip(clipped.tolist(), found.tolist())]
+            if not edges:
+                return (found, values)
+            return (found, values, numpy.array(self.flatEdges(positions.tolist(), found.tolist(), depths)))
+        positions = []
+        addPosition = positions.append
+        found = []
+        addFound = found.append
+        lo = 0
+        ordered = all(keys[i] <= keys[i + 1] for i in range(len(keys) - 1))
+        for key in keys:
+            i = bisect_left(flatKeys, key, lo)
+            if ordered:
+                lo = i
+            addPosition(i)
+            addFound(i < n and flatKeys[i] == key)
+        values = [nodes[i].value if hit else None for i, hit in zip(positions, found)]
+        if not edges:
+            return (found, values)
+        return (found, values, self.flatEdges(positions, found, depths))
+
+    def flattened(self, depths):
+        # helper, returns (keys, nodes, numpy keys or None, depths or None) in InOrder,
+        # rebuilt when the keys changed since the last call, depths only when asked for,
+        # numpy keys only once a numpy query needs them (see flatArray)
+        # time complexity O(n) after a change, O(1) otherwise
+        flat = self.flat
+        if flat is not None and flat[0] == self.version and (flat[4] is not None or not depths):
+            return flat[1:]
+        keys, nodes, nodeDepths = [], [], [] if depths else None
+        stack = []
+        node, depth = self.root, 0
+        while True:
+            while not node.isVirtual:
+                stack.append((node, depth))
+                node = node.left
+                depth += 1
+            if not stack:
+                break
+            node, depth = stack.pop()
+            keys.append(node.key)
+            nodes.append(node)
+            if depths:
+                nodeDepths.append(depth)
+            node = node.right
+            depth += 1
+        self.flat = (self.version, keys, nodes, None, nodeDepths)
+        return self.flat[1:]
+
+    def flatArray(self):
+        # helper, the flattened keys as a numpy array, kept with them until the next change
+        # time complexity O(n) on the first numpy query after a change, O(1) otherwise
+        flat = self.flat
+        if flat[3] is None:
+            self.flat = flat = flat[:3] + (numpy.asarray(flat[1]),) + flat[4:]
+        return flat[3]
+
+    def flatEdges(self, positions, found, depths):
+        # helper, the e of search for every key from its position in the flattened keys.
+        # a found key at depth d gives d + 1, a missing key ends below the deeper of its
+        # two neighbours, which are an ancestor and a descendant of each other
+        # time complexity O(m)
+        n = len(depths)
+        res = []
+        for i, hit in zip(positions, found):
+            if hit:
+                res.append(depths[i] + 1)
+            elif n == 0:
+                res.append(1)
+            else:
+                below = depths[i - 1] if i > 0 else -1
+                above = depths[i] if i < n else -1
+                res.append(max(below, above) + 2)
+        return res
+
+    """puts a lookup cache of the nodes of recently searched keys in front of search and finger_search
+
+    @type capacity: int
+    @param capacity: maximal number of cached keys, at least 1
+    @type policy: str
+    @param policy: eviction policy, "lru" or "clock"
+    """
+
+    def enable_cache(self, capacity, policy="lru"):
+        # time complexity O(1)
+        if capacity < 1:
+            raise ValueError("cache capacity must be at least 1, got %r" % (capacity,))
+        if policy == "lru":
+            self.cache = LRUNodeCache(capacity)
+        elif policy == "clock":
+            self.cache = ClockNodeCache(capacity)
+        else:
+            raise ValueError("unknown cache policy %r" % (policy,))
+
+    def disable_cache(self):
+        # time complexity O(1)
+        self.cache = None
+
+    """returns the counters of the lookup cache
+
+    @rtype: dict
+    @returns: hits, misses, evictions and current size of the cache, None if there is no cache
+    """
+
+    def cache_stats(self):
+        # time complexity O(1)
+        if self.cache is None:
+            return None
+        return {"hits": self.cache.hits, "misses": self.cache.misses,
+                "evictions": self.cache.evictions, "size": len(self.cache)}
+
+    """starts collecting AVLStats counters on the operations of self
+
+    @rtype: AVLStats
+    @returns: the counters, also available as self.stats
+    """
+
+    def enable_stats(self):
+        # time complexity O(1), the counters cost nothing while stats is None
+        if self.stats is None:
+            self.stats = AVLStats()
+        return self.stats
+
+    def disable_stats(self):
+        # time complexity O(1)
+        self.stats = None
+
+    """keeps in every node the aggregate of the values of its subtree under a monoid
+
+    @type combine: function
+    @param combine: associative function of two aggregates, e.g. operator.add or min
+    @type identity: any
+    @param identity: aggregate of no values, e.g. 0 for sum or float("inf") for min
+    @pre: every value of the dictionary is a valid aggregate (a value is aggregated as is)
+    """
+
+    def enable_aggregate(self, combine, identity):
+        # time complexity O(n) to compute the aggregates, then O(1) extra per node update
+        self.monoid = (combine, identity)
+        self.recomputeAggregates()
+
+    def disable_aggregate(self):
+        # time complexity O(1)
+        self.monoid = None
+
+    def recomputeAggregates(self, root=None):
+        # helper, computes the aggregate of every node under root (self.root if None),
+        # children before parents
+        # time complexity O(n)
+        order = []
+        stack = [self.root if root is None else root]
+        while stack:  # PreOrder with an explicit stack, then reversed
+            node = stack.pop()
+            if not node.isVirtual:
+                order.append(node)
+                stack.append(node.left)
+                stack.append(node.right)
+        for node in reversed(order):
+            self.updateAggregate(node)
+
+    """returns the aggregate of the values with keys in the half open range [lo, hi)
+
+    @type lo: int
+    @param lo: lower bound (inclusive), None for no lower bound
+    @type hi: int
+    @param hi: upper bound (exclusive), None for no upper bound
+    @pre: enable_aggregate was called
+    @rtype: any
+    @returns: the values combined in ascending key order, the identity if the range is empty
+    """
+
+    def aggregate(self, lo=None, hi=None):
+        # the descent stops at the first node inside the range, below it one path walks
+        # towards lo and one towards hi, each taking whole subtrees on the inner side
+        # time complexity O(h) = O(logn)
+        combine, identity = self.monoid
+        node = self.root
+        while not node.isVirtual:  # the highest node with lo <= key < hi
+            if lo is not None and node.key < lo:
+                node = node.right
+            elif hi is not None and node.key >= hi:
+                node = node.left
+            else:
+                break
+        if node.isVirtual:
+            return identity
+        res = node.value
+        current = node.left
+        while not current.isVirtual:  # every key here is < hi
+            if lo is None or current.key >= lo:
+                if not current.right.isVirtual:
+                    res = combine(current.right.agg, res)
+                res = combine(current.value, res)
+                current = current.left
+            else:
+                current = current.right
+        current = node.right
+        while not current.isVirtual:  # every key here is >= lo
+            if hi is None or current.key < hi:
+                if not current.left.isVirtual:
+                    res = combine(res, current.left.agg)
+                res = combine(res, current.value)
+                current = current.right
+            else:
+                current = current.left
+        return res
+
+    """changes the value of a node, keeping the aggregates current
+
+    @type node: AVLNode
+    @pre: node is a real node in self
+    @type val: any
+    @param val: the new value
+    """
+
+    def set_value(self, node, val):
+        # time complexity O(1), O(logn) with aggregates
+        node.value = val
+        if self.monoid is not None:
+            self.updateSizesUpwards(node)
+
+    def clearCache(self):
+        # helper, drops every cached node, for changes that move nodes between trees
+        # time complexity O(capacity)
+        if self.cache is not None:
+            self.cache.clear()
+
+    """searches for a node in the dictionary corresponding to the key, starting at a given node
+
+    @type node: AVLNode
+    @pre: node is a real node in self
+    @param node: the node to start from, typically the result of an earlier access
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (AVLNode,int)
+    @returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
+    and e is the number of edges on the path between the starting node and ending node+1.
+    """
+
+    def search_from(self, node, key):
+        # climb from node until key is in its subtree, then search downwards
+        # time complexity O(logd), d being the rank distance between node.key and key
+        node, e = self.fingerClimb(node, key, 1)
+        node, e = self.searchFromNode(node, key, e)
+        if self.stats is not None:
+            self.stats.recordSearch(e)
+        return (node, e)
+
+    def stickySearch(self, key):
+        # helper, search_from the sticky finger, moving the finger to the last node reached
+        # time complexity O(logd)
+        if not self.root.is_real_node():  # special case, tree is empty
+            return (None, 1)
+        node = self.finger if self.finger is not None else self.root
+        node, e = self.fingerClimb(node, key, 1)
+        while True:
+            if node.key == key:
+                self.finger = node
+                return (node, e)
+            nextNode = node.right if node.key < key else node.left
+            if not nextNode.is_real_node():
+                self.finger = node
+                return (None, e + 1)
+            node = nextNode
+            e += 1
+
     def fingerDownwardStart(self, key, e):
         # helper for finger functions.
         # Search from maximal node, return Node to start search downward to find key
@@ -156,15 +587,28 @@ class AVLTree(object):
             return (node, e)  ## cases we haven't repeated an edge on the route
         return (node, e - 2)
 
+    def fingerClimb(self, node, key, e):
+        # helper for finger functions from an arbitrary node.
+        # climbs until key lies strictly between node and its parent (so key belongs to node's
+        # subtree), or node holds key, or node is the root. return Node to start search downward
+        # time complexity O(logd), d being the rank distance between node.key and key
+        while node.parent.is_real_node() and node.key != key:
+            parentKey = node.parent.key
+            if (node.key < key < parentKey) or (parentKey < key < node.key):
+                break
+            node = node.parent
+            e += 1
+        return (node, e)
+
     """inserts a new node into the dictionary with corresponding key and value (starting at the root)
 
     @type key: int
-    @pre: key currently does not appear in the dictionary
+    @pre: key currently does not appear in the dictionary, unless self has a mode
     @param key: key of item that is to be inserted to self
     @type val: string
     @param val: the value of the item
     @rtype: (AVLNode,int,int)
-    @returns: a 3-tuple (x,e,h) where x is the new node,
+    @returns: a 3-tuple (x,e,h) where x is the new node (the node already holding key in a mode),
     e is the number of edges on the path between the starting node and new node before rebalancing,
     and h is the number of PROMOTE cases during the AVL rebalancing
     """
@@ -172,12 +616,13 @@ class AVLTree(object):
     def insert(self, key, val):
         # insert Node(key, value) to an AVL tree
         # time complexity O(h) = O(logn) using helper functions
-        node = AVLNode(key, val)
-        node.height = 0
-        current = self.root  ## physical creation
-        self.Treesize += 1  ## of the Node
-        node.left = self.virtual
-        node.right = self.virtual
+        if self.root.is_real_node() and self.monoid is None and self.stats is None:
+            return self.insertTopDown(key, val)
+        if self.mode is not None and self.root.is_real_node():
+            return self.upsertFromRoot(key, val)
+        node = self.createNode(key, val)  ## physical creation of the Node
+        current = self.root
+        self.Treesize += 1
 
         e = 2
 
@@ -191,10 +636,132 @@ class AVLTree(object):
 
             return self.insertHelper(current, node, e)
 
+    def insertTopDown(self, key, val):
+        # helper for insert from the root. subtree sizes are raised on the way down, so the
+        # walk back up only fixes heights and stops at the first node whose height is unchanged
+        # (or after the single rotation an insert needs), instead of rotationsCheck going on
+        # with updateSizesUpwards to the root. heights are read straight from the children.
+        # in a mode an equal key met on the way takes the value, so sizes are raised only once
+        # the key is known to be new, on a walk up from the new node.
+        # same (x,e,h) as insertHelper
+        # time complexity O(h) = O(logn) down, O(1) amortized up, O(logn) up for sizes in a mode
+        current = self.root
+        e = 2
+        if self.mode is None:
+            while True:  # find the place to allocate the new node
+                current.size += 1
+                if current.key > key:
+                    child = current.left
+                    if child.isVirtual:
+                        left = True
+                        break
+                else:
+                    child = current.right
+                    if child.isVirtual:
+                        left = False
+                        break
+                current = child
+                e += 1
+        else:
+            while True:
+                if current.key > key:
+                    child = current.left
+                    if child.isVirtual:
+                        left = True
+                        break
+                elif current.key < key:
+                    child = current.right
+                    if child.isVirtual:
+                        left = False
+                        break
+                else:
+                    return self.updateExisting(current, val, e - 1)
+                current = child
+                e += 1
+            ancestor = current
+            while not ancestor.isVirtual:
+                ancestor.size += 1
+                ancestor = ancestor.parent
+        node = self.createNode(key, val)
+        if left:
+            current.left = node
+        else:
+            current.right = node
+        self.Treesize += 1
+        node.parent = current
+        Hcounter = 0
+        while not current.isVirtual:
+            leftHeight = current.left.height
+            rightHeight = current.right.height
+            if leftHeight - rightHeight == 2:  # rotations keep the sizes above them correct
+                child = current.left
+                if child.left.height < child.right.height:
+                    self.rotateL(child)
+                self.rotateR(current)
+                break
+            if rightHeight - leftHeight == 2:
+                child = current.right
+                if child.right.height < child.left.height:
+                    self.rotateR(child)
+                self.rotateL(current)
+                break
+            height = (leftHeight if leftHeight > rightHeight else rightHeight) + 1
+            if height == current.height:
+                break
+            current.height = height  # PROMOTE, go on up
+            Hcounter += 1
+            current = current.parent
+        if self.max.key < key:
+            self.max = node
+        if self.min.key > key:
+            self.min = node
+        if self.sticky:
+            self.finger = node
+        return (node, e, Hcounter)
+
+    def createNode(self, key, val):
+        # helper, creates a detached leaf node ready to be linked into self
+        # every insertion path goes through here, so the key set version is bumped here
+        # time complexity O(1)
+        self.version += 1
+        if self.mode == "multimap":
+            val = [val]
+        node = AVLNode(key, val)
+        node.height = 0
+        node.left = self.virtual
+        node.right = self.virtual
+        if self.monoid is not None:
+            node.agg = val
+        return node
+
+    """inserts a new node into the dictionary with corresponding key and value, starting at a given node
+
+    @type node: AVLNode
+    @pre: node is a real node in self
+    @param node: the node to start from, typically the result of an earlier access
+    @type key: int
+    @pre: key currently does not appear in the dictionary, unless self has a mode
+    @param key: key of item that is to be inserted to self
+    @type val: string
+    @param val: the value of the item
+    @rtype: (AVLNode,int,int)
+    @returns: a 3-tuple (x,e,h) where x is the new node (the node already holding key in a mode),
+    e is the number of edges on the path between the starting node and new node before rebalancing,
+    and h is the number of PROMOTE cases during the AVL rebalancing
+    """
+
+    def insert_near(self, node, key, val):
+        # time complexity O(logd) to place the node, O(logn) to fix the sizes on the path
+        newNode = self.createNode(key, val)
+        self.Treesize += 1
+        current, e = self.fingerClimb(node, key, 2)
+        return self.insertHelper(current, newNode, e)
+
     def insertHelper(self, current, node, e):
         # helper func, unites node insert process from specified Node current downwards
+        # in upsert and multimap modes an equal key met on the way takes the value instead
         # time complexity O(h) = O(logn)
-        Hcounter = 0
+        mode = self.mode
         while True:  # find the place to allocate the new node
             if current.key > node.key:  # node correct position in current left subtree
                 if current.left.is_real_node():  # left move is to a real Node
@@ -203,6 +770,8 @@ class AVLTree(object):
                 else:
                     left = True  # place for insert, found, we are the left son of our father
                     break
+            elif mode is not None and current.key == node.key:
+                return self.insertEqual(current, node, e)
             else:  # node correct position in current right subtree
                 if current.right.is_real_node():  # right move is to a real Node
                     current = current.right
@@ -210,6 +779,12 @@ class AVLTree(object):
                 else:
                     left = False  # place for insert, found, we are the right son of our father
                     break
+        return self.linkNode(current, node, left, e)
+
+    def linkNode(self, current, node, left, e):
+        # helper, hangs the detached node below current (as its left son if left) and rebalances
+        # time complexity O(h) = O(logn)
+        Hcounter = 0
         node.parent = current  # adjust pointers from + to new Node
         if left:
             current.left = node
@@ -222,8 +797,53 @@ class AVLTree(object):
             self.max = node
         if (self.min.key > node.key):
             self.min = node
+        if self.sticky:
+            self.finger = node
         return (node, e, Hcounter)
 
+    def insertEqual(self, current, node, e):
+        # helper, gives the value of the detached node to current, which holds the same key.
+        # the caller counted node in Treesize already, e counts one edge below current
+        # time complexity O(1), O(logn) with aggregates
+        self.Treesize -= 1
+        return self.updateExisting(current, node.value[0] if self.mode == "multimap" else node.value, e - 1)
+
+    def updateExisting(self, current, val, e):
+        # helper, replaces (upsert) or extends (multimap) the value of current
+        # time complexity O(1), O(logn) with aggregates
+        if self.mode == "upsert":
+            current.value = val
+        else:
+            current.value.append(val)
+        if self.monoid is not None:
+            self.updateSizesUpwards(current)
+        if self.sticky:
+            self.finger = current
+        return (current, e, 0)
+
+    def upsertFromRoot(self, key, val):
+        # helper for insert in a mode, one descent from the root that allocates
+        # a node only when key is new
+        # time complexity O(h) = O(logn)
+        current = self.root
+        e = 2
+        while True:
+            if current.key > key:
+                if current.left.isVirtual:
+                    left = True
+                    break
+                current = current.left
+            elif current.key < key:
+                if current.right.isVirtual:
+                    left = False
+                    break
+                current = current.right
+            else:
+                return self.updateExisting(current, val, e - 1)
+            e += 1
+        self.Treesize += 1
+        return self.linkNode(current, self.createNode(key, val), left, e)
+
     def rotateR(self, A):
         # function adjust pointers for Right rotation
         # time complexity O(1)
@@ -242,7 +862,12 @@ class AVLTree(object):
             B.right.parent = A
         B.right = A
         A.updateHeight()
+        A.updateSize()
         B.updateHeight()
+        B.updateSize()
+        if self.monoid is not None:
+            self.updateAggregate(A)
+            self.updateAggregate(B)
 
     def rotateL(self, A):
         # function adjust pointers for Left rotation
@@ -262,17 +887,22 @@ class AVLTree(object):
             B.left.parent = A
         B.left = A
         A.updateHeight()
+        A.updateSize()
         B.updateHeight()
+        B.updateSize()
+        if self.monoid is not None:
+            self.updateAggregate(A)
+            self.updateAggregate(B)
 
     """inserts a new node into the dictionary with corresponding key and value, starting at the max
 
     @type key: int
-    @pre: key currently does not appear in the dictionary
+    @pre: key currently does not appear in the dictionary, unless self has a mode
     @param key: key of item that is to be inserted to self
     @type val: string
     @param val: the value of the item
     @rtype: (AVLNode,int,int)
-    @returns: a 3-tuple (x,e,h) where x is the new node,
+    @returns: a 3-tuple (x,e,h) where x is the new node (the node already holding key in a mode),
     e is the number of edges on the path between the starting node and new node before rebalancing,
     and h is the number of PROMOTE cases during the AVL rebalancing
     """
@@ -280,11 +910,8 @@ class AVLTree(object):
     def finger_insert(self, key, val):
         # insert Node (key, value) in AVL tree starting from the maximal node
         # time complexity O(h) = O(logn) using helper functions
-        node = AVLNode(key, val)
-        node.height = 0
-        self.Treesize += 1  ## physical creation
-        node.left = self.virtual  ## of the node
-        node.right = self.virtual
+        node = self.createNode(key, val)  ## physical creation of the node
+        self.Treesize += 1
 
         e = 2
 
@@ -312,9 +939,83 @@ class AVLTree(object):
     def delete(self, node):
         # delete node from AVL tree. assumes node is in self
         # time complexity O(h) = O(logn) using helper functions
-        if (self.max.key == node.key):  ## adjust max/min nodes if necessary
+        self.deleteHelper(node)
+        return
+
+    """deletes the node of key from the dictionary
+
+    @type key: int
+    @param key: key to be deleted
+    @rtype: bool
+    @returns: True if key was found and deleted, False if it is not in the dictionary
+    """
+
+    def delete_key(self, key):
+        # one descent to the node, then the usual removal below and above it
+        # time complexity O(h) = O(logn)
+        node = self.searchFromNode(self.root, key, 1)[0]
+        if node is None:
+            return False
+        self.deleteHelper(node)
+        return True
+
+    """deletes every key in the half open range [lo, hi)
+
+    @type lo: int
+    @param lo: lower bound (inclusive), None for no lower bound
+    @type hi: int
+    @param hi: upper bound (exclusive), None for no upper bound
+    @rtype: int
+    @returns: the number of deleted keys
+    """
+
+    def delete_range(self, lo=None, hi=None):
+        # a few keys are deleted one by one, otherwise self is split at lo and at hi and the
+        # outer parts are joined back, the range is dropped whole without visiting its nodes
+        # time complexity O(logn) for the split, O(removed * logn) below RANGE_DELETE_CUTOFF
+        count = self.count_range(lo, hi)
+        if count == 0:
+            return 0
+        if count <= self.RANGE_DELETE_CUTOFF:
+            for node in list(self.iterNodes(lo, hi, False)):
+                self.deleteHelper(node)
+            return count
+        if lo is None:
+            smaller, rest = self.emptyLike(), self
+        else:
+            smaller, _, rest = self.splitKey(lo)
+        if hi is None:
+            kept, bigger = None, self.emptyLike()
+        else:
+            _, kept, bigger = rest.splitKey(hi)
+        if kept is not None:  # the node of hi is not in the range
+            smaller.joinNode(bigger, kept)
+        else:
+            smaller = smaller.concat(bigger)
+        self.adoptTree(smaller, True)
+        return count
+
+    def emptyLike(self):
+        # helper, an empty tree of the class, mode and monoid of self, counting into the stats of
+        # self, so the joins split and the set operations make on their pieces are recorded
+        # time complexity O(1)
+        tree = type(self)(mode=self.mode)
+        tree.monoid = self.monoid
+        tree.stats = self.stats
+        return tree
+
+    def deleteHelper(self, node):
+        # helper func, physically removes node and rebalances
+        # returns the number of PROMOTE cases (height changes without rotation) on the way up
+        # time complexity O(h) = O(logn)
+        if self.finger is node:
+            self.finger = None
+        if self.cache is not None:
+            self.cache.discard(node.key)
+        self.version += 1
+        if self.max is node:  ## adjust max/min nodes if necessary
             self.max = self.predecessor(node)
-        if (self.min.key == node.key):
+        if self.min is node:
             self.min = self.successor(node)
         self.Treesize -= 1
         ## differ physical Node removal and Pointers adjustment based on Node type of sons
@@ -334,6 +1035,7 @@ class AVLTree(object):
             current = node.parent
         else:  # has two sons
             successorNode = self.successor(node)
+            successorNode.height = node.height  # ancestors still see node's old height
             if (node.right is successorNode):  # successor is direct child of node
                 current = successorNode
                 successorNode.left = node.left  # update the left side
@@ -351,20 +1053,142 @@ class AVLTree(object):
                 node.right.parent = successorNode  ## node sons
                 node.left.parent = successorNode  ##changes their parent
                 self.selectedNode_father_sub_connection(node, node.parent, successorNode)
-                successorNode.updateHeight()
 
-        self.rotationsCheck(current, 0, False)  ## rotation check from the node physically removes
+        return self.rotationsCheck(current, 0, False)  ## rotation check from the node physically removes
 
-        return
+    """inserts a batch of items into the dictionary
 
-    def rotationsCheck(self, current, Hcounter, insert):
+    @type pairs: iterable
+    @pre: keys are distinct and do not currently appear in the dictionary, unless self has a mode
+    @param pairs: (key, value) pairs to be inserted, in any order
+    @rtype: (int,int,int)
+    @returns: a 3-tuple (k,e,h) where k is the number of inserted items,
+    e is the total number of edges walked to place them (0 when the batch is merged by union),
+    and h is the total number of PROMOTE cases
+    """
+
+    def insert_many(self, pairs):
+        # the batch is sorted, so every key is placed by climbing from the previously inserted
+        # node instead of descending from the root. a batch that is large relative to self
+        # is built into a tree of its own and merged with self by union
+        # time complexity O(mlogm + mlog(n/m + 1))
+        batch = sorted(pairs, key=lambda item: item[0])
+        m = len(batch)
+        if m == 0:
+            return (0, 0, 0)
+        if m * self.BULK_RATIO >= self.Treesize:
+            merge = None
+            if self.mode == "multimap":
+                batch = [(key, [val]) for key, val in batch]
+                merge = lambda mine, theirs: mine + theirs
+            elif self.mode == "upsert":
+                merge = lambda mine, theirs: theirs
+            if self.mode is not None:
+                batch = self.mergeEqualKeys(batch)
+            self.union(type(self).from_sorted(batch), merge)
+            return (m, 0, 0)
+        e = h = 0
+        finger = None
+        for key, val in batch:
+            if finger is None:
+                finger, ei, hi = self.insert(key, val)
+            else:
+                node = self.createNode(key, val)
+                self.Treesize += 1
+                current, ei = self.fingerClimb(finger, key, 2)
+                finger, ei, hi = self.insertHelper(current, node, ei)
+            e += ei
+            h += hi
+        return (m, e, h)
+
+    def mergeEqualKeys(self, items):
+        # helper generator, turns runs of equal keys in sorted items into one item each,
+        # the last value wins in upsert mode, the value lists are concatenated in multimap mode
+        # time complexity O(1) amortized per item
+        last = None
+        for item in items:
+            if last is not None and last[0] == item[0]:
+                if self.mode == "upsert":
+                    last = item
+                else:
+                    last[1].extend(item[1])
+                continue
+            if last is not None:
+                yield last
+            last = item
+        if last is not None:
+            yield last
+
+    """deletes a batch of keys from the dictionary
+
+    @type keys: iterable
+    @param keys: keys to be deleted, in any order, keys not in the dictionary are ignored
+    @rtype: (int,int,int)
+    @returns: a 3-tuple (k,e,h) where k is the number of deleted items,
+    e is the total number of edges walked to find them (0 when the batch is removed by difference),
+    and h is the total number of PROMOTE cases
+    """
+
+    def delete_many(self, keys):
+        # same strategy as insert_many, the search for every key climbs from
+        # the neighbourhood of the previously deleted one, a large batch is removed by difference
+        # time complexity O(mlogm + mlog(n/m + 1))
+        batch = sorted(keys)
+        m = len(batch)
+        if m == 0:
+            return (0, 0, 0)
+        if m * self.BULK_RATIO >= self.Treesize:
+            size = self.Treesize
+            unique = [(key, None) for i, key in enumerate(batch) if i == 0 or batch[i - 1] != key]
+            self.difference(type(self).from_sorted(unique))
+            return (size - self.Treesize, 0, 0)
+        e = h = removed = 0
+        finger = self.root
+        for key in batch:
+            if not self.root.is_real_node():  # special case, tree became empty
+                break
+            current, ei = self.fingerClimb(finger, key, 1)
+            node, ei = self.searchFromNode(current, key, ei)
+            e += ei
+            if node is None:
+                finger = current
+                continue
+            finger = node.parent  # stays in the tree, unlike node
+            h += self.deleteHelper(node)
+            removed += 1
+            if not finger.is_real_node():
+                finger = self.root
+        return (removed, e, h)
+
+    def adoptTree(self, tree, aggregated=False):
+        # helper, makes self hold the nodes of tree (tree must not be used afterwards)
+        # aggregated tells that the nodes of tree already hold the aggregates of self's monoid
+        # time complexity O(1), O(n) to recompute aggregates
+        self.root = tree.root
+        self.min = tree.min
+        self.max = tree.max
+        self.Treesize = tree.Treesize
+        self.finger = None
+        self.clearCache()
+        self.version += 1
+        if self.monoid is not None and not aggregated:  # tree was built without aggregates
+            self.recomputeAggregates()
+
+    def rotationsCheck(self, current, Hcounter, insert, operation="delete"):
         # helper functions verify rotation by the algorithem from certain Node current upwards
         # boolean insert for break possibility in case 3
+        # operation names the caller when not insert ("delete" or "join"), for the stats only
+        # subtree sizes change all the way up, so they are fixed up to the root after the break
         # time complexity O(currentDepth) = O(logn)
-
+        startHcounter = Hcounter
+        stats = self.stats
+        monoid = self.monoid
         while current.is_real_node():  # search for possible BF violation by known algorithem
             previousHeight = current.height
             current.updateHeight()
+            current.updateSize()
+            if monoid is not None:
+                self.updateAggregate(current)
             BF = current.balanceFactor()
             if ((previousHeight == current.height) and (abs(BF) < 2)):  ## case 1, Immediate termination
                 break
@@ -388,12 +1212,42 @@ class AVLTree(object):
 
                     else:
                         self.rotateL(current)
+                if stats is not None:
+                    stats.recordRotation("insert" if insert else operation, BF * BFChild < 0)
                 if (insert):  ## insert require 1 rotation at most
                     break
                 else:
                     current = temp
+        self.updateSizesUpwards(current)
+        if stats is not None:
+            stats.promotes["insert" if insert else operation] += Hcounter - startHcounter
         return Hcounter
 
+    def updateSizesUpwards(self, current):
+        # helper, recomputes subtree sizes (and aggregates) from current up to the root
+        # time complexity O(currentDepth) = O(logn)
+        if self.monoid is not None:
+            while current.is_real_node():
+                current.updateSize()
+                self.updateAggregate(current)
+                current = current.parent
+            return
+        while current.is_real_node():
+            current.updateSize()
+            current = current.parent
+
+    def updateAggregate(self, node):
+        # helper, recomputes the aggregate of node from its children, virtual children count
+        # as the identity without reading them (they may be the virtual node of another tree)
+        # time complexity O(1)
+        combine = self.monoid[0]
+        agg = node.value
+        if not node.left.isVirtual:
+            agg = combine(node.left.agg, agg)
+        if not node.right.isVirtual:
+            agg = combine(agg, node.right.agg)
+        node.agg = agg
+
     def selectedNode_father_sub_connection(self, node, father, subNode):
         ## helper function, assumes node.parent = father, adjust pointers between father and subNode
         ## subNode replaces node
@@ -450,9 +1304,24 @@ class AVLTree(object):
 
     def join(self, tree2, key, val):
         ## function joins tree2 into self using mediator Node(key,val)
+        # time complexity O(logn), O(logn + size of tree2) when only self has aggregates
+        if self.mode == "multimap":  # stored as createNode stores it
+            val = [val]
+        if self.monoid is not None and (tree2.monoid != self.monoid or
+                                        type(tree2).updateAggregate is not type(self).updateAggregate):
+            self.recomputeAggregates(tree2.root)  # the nodes of tree2 hold other aggregates or none
+        self.joinNode(tree2, AVLNode(key, val))  # creating node
+
+    def joinNode(self, tree2, x):
+        # helper for join and for split and the set operations, joins tree2 into self using the
+        # detached node x as the mediator, x.value is kept as it is (already a stored value)
         # time complexity O(logn)
         self.Treesize += +tree2.Treesize + 1  # updating size
-        x = AVLNode(key, val)  # creating node
+        tree2.clearCache()  # nodes of tree2 now belong to self
+        self.version += 1
+        tree2.version += 1
+        if self.stats is not None:
+            self.stats.recordJoin(abs(tree2.root.height - self.root.height))
         x.right = x.left = x.parent = self.virtual
         if tree2.root.height < self.root.height:  # join by allocating tree2 as subtree for self
             self.genericJoin(self, tree2, x)
@@ -468,7 +1337,10 @@ class AVLTree(object):
                 self.root, self.max, self.min = x, x, x
 
         x.updateHeight()
-        self.rotationsCheck(x.parent, 0, False)  # balancing the tree
+        x.updateSize()
+        if self.monoid is not None:
+            self.updateAggregate(x)
+        self.rotationsCheck(x.parent, 0, False, "join")  # balancing the tree
 
         return
 
@@ -551,84 +1423,3293 @@ class AVLTree(object):
 
     def split(self, node):
         # delete node from the tree and return two subtress , one bigger values, other smaller values
-        # size field invariant isnt correct after calling this method
+        # sizes of both trees are kept correct through createByRoot and join
+        # the ancestors of node are relinked as the mediators, no node is allocated,
+        # so handles to every node but node stay valid in the two trees
         # time complexity O(logn)
-        smallerTree = AVLTree()
+        self.clearCache()
+        self.version += 1
+        smallerTree = self.emptyLike()
         smallerTree.createByRoot(node.left)
-        biggerTree = AVLTree()
+        biggerTree = self.emptyLike()
         biggerTree.createByRoot(node.right)
-        while node.key != self.root.key:
+        pieces = 0
+        parent = node.parent
+        while node is not self.root:
+            pieces += 1
+            grandparent = parent.parent  # read first, parent is joined as the mediator itself
+            uniteTree = self.emptyLike()  # holds nodes of self, with the aggregates of self
+            if (parent.right is node):  # smaller  values tree Accumulation
 
-            uniteTree = AVLTree()
-            if (node.parent.right is node):  # smaller  values tree Accumulation
+                uniteTree.createByRoot(parent.left)
 
-                uniteTree.createByRoot(node.parent.left)
-
-                smallerTree.join(uniteTree, node.parent.key, node.parent.value)
+                smallerTree.joinNode(uniteTree, parent)
             else:  # bigger values tree Accumulation
-                uniteTree.createByRoot(node.parent.right)
-                biggerTree.join(uniteTree, node.parent.key, node.parent.value)
+                uniteTree.createByRoot(parent.right)
+                biggerTree.joinNode(uniteTree, parent)
 
-            node = node.parent
+            node, parent = parent, grandparent
+        if self.stats is not None:
+            self.stats.recordSplit(pieces)
         smallerTree.max = smallerTree.root.findMax()
         smallerTree.min = smallerTree.root.findMin()
         biggerTree.max = biggerTree.root.findMax()
         biggerTree.min = biggerTree.root.findMin()
         return smallerTree, biggerTree
 
-    """returns an array representing dictionary 
+    def splitKey(self, key):
+        # helper, splits self around key which may be absent from self.
+        # the split is made at the last node on the search path for key, and that node itself is
+        # joined back as the extreme of the side it belongs to (insert would allocate a new node
+        # and wrap a multimap value list again). returns (smaller, node of key or None, bigger)
+        # time complexity O(logn)
+        if not self.root.is_real_node():  # special case, nothing to split
+            return self, None, self.emptyLike()
+        node = self.root
+        last = node
+        while node.is_real_node() and node.key != key:
+            last = node
+            node = node.right if node.key < key else node.left
+        if node.is_real_node():
+            smallerTree, biggerTree = self.split(node)
+            return smallerTree, node, biggerTree
+        smallerTree, biggerTree = self.split(last)
+        if last.key < key:
+            smallerTree.joinNode(self.emptyLike(), last)
+        else:
+            biggerTree.joinNode(self.emptyLike(), last)
+        return smallerTree, None, biggerTree
 
-    @rtype: list
-    @returns: a sorted list according to key of touples (key, value) representing the data structure
-    """
+    def concat(self, tree2):
+        # helper, joins tree2 (all keys bigger than self) into self without a mediator key,
+        # the maximum of self is removed and used as the mediator
+        # time complexity O(logn)
+        if not tree2.root.is_real_node():
+            return self
+        if not self.root.is_real_node():
+            return tree2
+        self.max = self.root.findMax()
+        self.min = self.root.findMin()
+        mediator = self.max
+        self.delete(mediator)
+        self.joinNode(tree2, mediator)
+        return self
 
-    def avl_to_array(self):
-        # regular InOrder tree walk
-        # time complexity O(n)
-        res = []
+    def subTree(self, rootNode):
+        # helper, a tree object over the subtree of rootNode, detached from its parent
+        # time complexity O(1)
+        tree = self.emptyLike()
+        tree.createByRoot(rootNode)
+        return tree
 
-        def avlToArrayRec(node):
-            # inner function preforming the recursion
-            if not node.is_real_node():
-                return
-            avlToArrayRec(node.left)
-            res.append((node.key, node.value))
-            avlToArrayRec(node.right)
+    """merges other into self, self holds every key that is in self or in other
 
-        if (self.root.is_real_node()):
-            avlToArrayRec(self.root)
-        return res
+    @type other: AVLTree
+    @param other: a dictionary, its nodes are moved into self and it is left empty
+    @type merge: function
+    @param merge: merge(value in self, value in other) returns the value of a key in both,
+    the value in self is kept if None
+    @rtype: AVLTree
+    @returns: self
+    """
 
-    """returns the node with the maximal key in the dictionary
+    def union(self, other, merge=None):
+        # join based divide and conquer on the root of other (Blelloch et al., "Just join")
+        # time complexity O(mlog(n/m + 1)), m <= n being the sizes of the two dictionaries
+        return self.setOperation(self.unionRec, other, merge)
 
-    @rtype: AVLNode
-    @returns: the maximal node, None if the dictionary is empty
+    """keeps in self only the keys that are also in other
+
+    @type other: AVLTree
+    @param other: a dictionary, it is left empty
+    @type merge: function
+    @param merge: merge(value in self, value in other) returns the value of a key in both,
+    the value in self is kept if None
+    @rtype: AVLTree
+    @returns: self
     """
 
-    def max_node(self):
-        # time complexity O(1) return field
-        return self.max
+    def intersection(self, other, merge=None):
+        # time complexity O(mlog(n/m + 1))
+        return self.setOperation(self.intersectionRec, other, merge)
 
-    """returns the number of items in dictionary 
+    """removes from self every key that is in other
 
-    @rtype: int
-    @returns: the number of items in dictionary 
+    @type other: AVLTree
+    @param other: a dictionary, it is left empty
+    @rtype: AVLTree
+    @returns: self
     """
 
-    def size(self):
-        # time complexity O(1) return field
-        return self.Treesize
+    def difference(self, other):
+        # time complexity O(mlog(n/m + 1))
+        return self.setOperation(self.differenceRec, other, None)
 
-    """returns the root of the tree representing the dictionary
+    """keeps in self the keys that are in exactly one of self and other
 
-    @rtype: AVLNode
-    @returns: the root, None if the dictionary is empty
+    @type other: AVLTree
+    @param other: a dictionary, its nodes are moved into self and it is left empty
+    @rtype: AVLTree
+    @returns: self
     """
 
-    def get_root(self):
-        # time complexity O(1) return field
-        return self.root
+    def symmetric_difference(self, other):
+        # time complexity O(mlog(n/m + 1))
+        return self.setOperation(self.symmetricDifferenceRec, other, None)
 
-    """returns the root of the tree representing the dictionary
-    @rtype: AVLNode
-    """
+    def setOperation(self, operationRec, other, merge):
+        # helper, runs one of the recursive set operations and moves its result into self
+        # time complexity that of operationRec, plus O(n + m) when self has aggregates
+        if merge is None:
+            merge = lambda mine, theirs: mine
+        monoids = (self.monoid, other.monoid)
+        self.monoid = other.monoid = None  # aggregates are recomputed once, by adoptTree
+        result = operationRec(self, other, merge)
+        if result.root.is_real_node():
+            result.min = result.root.findMin()
+            result.max = result.root.findMax()
+        else:
+            result.min = result.max = None
+        self.monoid, other.monoid = monoids
+        self.adoptTree(result)
+        other.adoptTree(type(self)())
+        return self
+
+    def unionRec(self, t1, t2, merge):
+        # helper, returns a tree of t1 | t2, t1 and t2 are consumed
+        # recursion depth O(t2 height)
+        if not t1.root.is_real_node():
+            return t2
+        if not t2.root.is_real_node():
+            return t1
+        pivot = t2.root
+        smaller, found, bigger = t1.splitKey(pivot.key)
+        res = self.unionRec(smaller, self.subTree(pivot.left), merge)
+        resBig = self.unionRec(bigger, self.subTree(pivot.right), merge)
+        if found is None:
+            res.joinNode(resBig, pivot)
+        else:  # the node of self stays, so handles to it stay valid
+            found.value = merge(found.value, pivot.value)
+            res.joinNode(resBig, found)
+        return res
+
+    def intersectionRec(self, t1, t2, merge):
+        # helper, returns a tree of t1 & t2, t1 and t2 are consumed
+        # recursion depth O(t2 height)
+        if not (t1.root.is_real_node() and t2.root.is_real_node()):
+            return self.emptyLike()
+        pivot = t2.root
+        smaller, found, bigger = t1.splitKey(pivot.key)
+        res = self.intersectionRec(smaller, self.subTree(pivot.left), merge)
+        resBig = self.intersectionRec(bigger, self.subTree(pivot.right), merge)
+        if found is None:
+            return res.concat(resBig)
+        found.value = merge(found.value, pivot.value)
+        res.joinNode(resBig, found)
+        return res
+
+    def differenceRec(self, t1, t2, merge):
+        # helper, returns a tree of t1 - t2, t1 and t2 are consumed
+        # recursion depth O(t2 height)
+        if not (t1.root.is_real_node() and t2.root.is_real_node()):
+            return t1
+        pivot = t2.root
+        smaller, found, bigger = t1.splitKey(pivot.key)
+        res = self.differenceRec(smaller, self.subTree(pivot.left), merge)
+        return res.concat(self.differenceRec(bigger, self.subTree(pivot.right), merge))
+
+    def symmetricDifferenceRec(self, t1, t2, merge):
+        # helper, returns a tree of t1 ^ t2, t1 and t2 are consumed
+        # recursion depth O(t2 height)
+        if not t1.root.is_real_node():
+            return t2
+        if not t2.root.is_real_node():
+            return t1
+        pivot = t2.root
+        smaller, found, bigger = t1.splitKey(pivot.key)
+        res = self.symmetricDifferenceRec(smaller, self.subTree(pivot.left), merge)
+        resBig = self.symmetricDifferenceRec(bigger, self.subTree(pivot.right), merge)
+        if found is not None:
+            return res.concat(resBig)
+        res.joinNode(resBig, pivot)
+        return res
+
+    """builds an AVL tree from (key, value) pairs given in any order, sorting on a process pool
+
+    @type items: iterable
+    @pre: keys are distinct
+    @param items: (key, value) pairs to be stored in the tree
+    @type workers: int
+    @param workers: number of worker processes, os.cpu_count() if None
+    @type cutoff: int
+    @param cutoff: inputs smaller than cutoff are built sequentially, PARALLEL_CUTOFF if None
+    @rtype: AVLTree
+    @returns: a balanced AVLTree holding items
+    """
+
+    @classmethod
+    def parallel_from_unsorted(cls, items, workers=None, cutoff=None):
+        # the input is partitioned at sampled pivot keys, every worker sorts one part,
+        # the parts are built with from_sorted and stitched with join at the pivots
+        # time complexity O(nlogn / workers + n)
+        items = items if isinstance(items, list) else list(items)
+        workers = workers or os.cpu_count() or 1
+        cutoff = cls.PARALLEL_CUTOFF if cutoff is None else cutoff
+        if workers == 1 or len(items) < max(cutoff, 2 * workers):
+            return cls.from_unsorted(items)
+        sample = sorted(item[0] for item in random.sample(items, min(len(items), 64 * workers)))
+        pivots = sorted(set(sample[len(sample) * i // workers] for i in range(1, workers)))
+        parts = [[] for _ in range(len(pivots) + 1)]
+        for item in items:
+            parts[bisect_right(pivots, item[0])].append(item)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sortedParts = list(pool.map(parallelSortWorker, parts))
+        pieces = []
+        mediators = []
+        for keys, values in sortedParts:  # first item of every part but the first is a mediator
+            if pieces and keys:
+                mediators.append((keys[0], values[0]))
+                keys, values = keys[1:], values[1:]
+            elif pieces:
+                mediators.append(None)
+            pieces.append(cls.from_sorted(zip(keys, values)))
+        return cls.stitch(pieces, mediators)
+
+    """merges other into self like union, processing key ranges on a process pool
+
+    @type other: AVLTree
+    @param other: a dictionary, it is left empty
+    @type merge: function
+    @param merge: as in union, must be picklable (a module level function)
+    @type workers: int
+    @param workers: number of worker processes, os.cpu_count() if None
+    @type cutoff: int
+    @param cutoff: below this many items in total union runs sequentially, PARALLEL_CUTOFF if None
+    @rtype: AVLTree
+    @returns: self
+    """
+
+    def parallel_union(self, other, merge=None, workers=None, cutoff=None):
+        # both trees are split at pivot keys of self chosen by rank, every pair of pieces is sent
+        # to a worker in serialized form, and the results are rebuilt and joined at the pivots
+        # time complexity O((n + m) / workers) work per worker, O(n + m) serialization
+        workers = workers or os.cpu_count() or 1
+        cutoff = self.PARALLEL_CUTOFF if cutoff is None else cutoff
+        if workers == 1 or self.Treesize + other.Treesize < cutoff or self.Treesize < 2 * workers:
+            return self.union(other, merge)
+        pivots = [self.select(self.Treesize * i // workers).key for i in range(1, workers)]
+        myPieces, myFound = self.splitAtPivots(pivots)
+        otherPieces, otherFound = other.splitAtPivots(pivots)
+        tasks = [(serializeTree(a), serializeTree(b), merge) for a, b in zip(myPieces, otherPieces)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parallelUnionWorker, tasks))
+        mediators = []
+        for pivot, mine, theirs in zip(pivots, myFound, otherFound):
+            value = mine.value if (theirs is None or merge is None) else merge(mine.value, theirs.value)
+            mediators.append((pivot, value))
+        result = self.stitch([deserializeTree(type(self), data) for data in results], mediators)
+        self.adoptTree(result)
+        other.adoptTree(type(self)())
+        return self
+
+    """keeps in self only the items for which predicate(key, value) is true, on a process pool
+
+    @type predicate: function
+    @param predicate: must be picklable (a module level function)
+    @type workers: int
+    @param workers: number of worker processes, os.cpu_count() if None
+    @type cutoff: int
+    @param cutoff: smaller dictionaries are filtered sequentially, PARALLEL_CUTOFF if None
+    @rtype: AVLTree
+    @returns: self
+    """
+
+    def parallel_filter(self, predicate, workers=None, cutoff=None):
+        # self is split at pivot keys chosen by rank, workers filter the serialized pieces,
+        # the pivots are tested here and used as join mediators when kept
+        # time complexity O(n / workers) predicate calls per worker, O(n) serialization
+        workers = workers or os.cpu_count() or 1
+        cutoff = self.PARALLEL_CUTOFF if cutoff is None else cutoff
+        if workers == 1 or self.Treesize < max(cutoff, 2 * workers):
+            kept = parallelFilterWorker((serializeTree(self), predicate))
+            self.adoptTree(deserializeTree(type(self), kept))
+            return self
+        pivots = [self.select(self.Treesize * i // workers).key for i in range(1, workers)]
+        pieces, found = self.splitAtPivots(pivots)
+        tasks = [(serializeTree(piece), predicate) for piece in pieces]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parallelFilterWorker, tasks))
+        mediators = [(node.key, node.value) if predicate(node.key, node.value) else None for node in found]
+        self.adoptTree(self.stitch([deserializeTree(type(self), data) for data in results], mediators))
+        return self
+
+    def splitAtPivots(self, pivots):
+        # helper, splits self at ascending pivot keys, self is consumed.
+        # returns (pieces, found) with len(pivots) + 1 trees and the node of every pivot (or None)
+        # time complexity O(len(pivots) * logn)
+        pieces = []
+        found = []
+        rest = self
+        for pivot in pivots:
+            smaller, node, rest = rest.splitKey(pivot)
+            pieces.append(smaller)
+            found.append(node)
+        pieces.append(rest)
+        return pieces, found
+
+    @classmethod
+    def stitch(cls, pieces, mediators):
+        # helper, joins ascending pieces, mediators[i] is the (key, value) between pieces i and
+        # i+1 or None when they are to be concatenated directly
+        # time complexity O(len(pieces) * logn)
+        result = pieces[0]
+        for piece, mediator in zip(pieces[1:], mediators):
+            if mediator is None:
+                result = result.concat(piece)
+            else:
+                result.joinNode(piece, AVLNode(mediator[0], mediator[1]))
+        if result.root.is_real_node():
+            result.min = result.root.findMin()
+            result.max = result.root.findMax()
+        return result
+
+    """writes the dictionary to a file in the binary format read by load and MappedAVLTree
+
+    @type path: str
+    @param path: file to be written
+    @pre: keys are integers that fit in 64 bits
+    """
+
+    def dump(self, path):
+        # keys are stored in order, the shape is the balanced one of from_sorted over that order
+        # so it needs no space and load rebuilds it without any rebalancing
+        # time complexity O(n)
+        writeTreeFile(path, self.items(), self.Treesize)
+
+    """reads a dictionary written by dump
+
+    @type path: str
+    @param path: file to be read
+    @rtype: AVLTree
+    @returns: a balanced AVLTree holding the items of the file
+    """
+
+    @classmethod
+    def load(cls, path):
+        # time complexity O(n), one pass over the file
+        with MappedAVLTree(path) as mapped:
+            return cls.from_sorted(mapped.items())
+
+    """returns an array representing dictionary 
+
+    @rtype: list
+    @returns: a sorted list according to key of touples (key, value) representing the data structure
+    """
+
+    def avl_to_array(self):
+        # InOrder walk with an explicit stack, no Python call per node
+        # time complexity O(n), O(logn) extra memory
+        res = []
+        add = res.append
+        stack = []
+        push, pop = stack.append, stack.pop
+        node = self.root
+        while True:
+            while not node.isVirtual:
+                push(node)
+                node = node.left
+            if not stack:
+                return res
+            node = pop()
+            add((node.key, node.value))
+            node = node.right
+
+    """returns the keys and the values of the dictionary as two sequences sorted by key
+
+    @type typecode: str
+    @param typecode: array typecode for the keys (e.g. 'q' or 'd'), None for a list
+    @rtype: tuple
+    @returns: (keys, values), keys is an array.array of typecode or a list, values is a list
+    """
+
+    def to_arrays(self, typecode=None):
+        # same walk as avl_to_array without building a tuple per node
+        # time complexity O(n)
+        keys, values = [], []
+        addKey, addValue = keys.append, values.append
+        stack = []
+        push, pop = stack.append, stack.pop
+        node = self.root
+        while True:
+            while not node.isVirtual:
+                push(node)
+                node = node.left
+            if not stack:
+                break
+            node = pop()
+            addKey(node.key)
+            addValue(node.value)
+            node = node.right
+        if typecode is not None:
+            keys = array(typecode, keys)
+        return keys, values
+
+    """checks every invariant of the tree
+
+    @rtype: bool
+    @returns: True, raises ValueError describing the first broken invariant otherwise
+    checked: BST order, heights, sizes, balance factors, parent pointers, min, max and Treesize
+    """
+
+    def validate(self):
+        # one InOrder walk with an explicit stack, every node is checked against its children
+        # time complexity O(n), O(logn) extra memory
+        if not self.root.isVirtual and not self.root.parent.isVirtual:
+            raise ValueError("root %r has a real parent" % (self.root.key,))
+        count = 0
+        first = last = None
+        stack = []
+        node = self.root
+        while True:
+            while not node.isVirtual:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                break
+            node = stack.pop()
+            left, right = node.left, node.right
+            for child in (left, right):
+                if child.isVirtual:
+                    if child.height != -1 or child.size != 0:
+                        raise ValueError("virtual child of %r has height %r and size %r"
+                                         % (node.key, child.height, child.size))
+                elif child.parent is not node:
+                    raise ValueError("child %r of %r has a wrong parent" % (child.key, node.key))
+            if node.height != max(left.height, right.height) + 1:
+                raise ValueError("node %r has height %r, expected %r"
+                                 % (node.key, node.height, max(left.height, right.height) + 1))
+            if node.size != left.size + right.size + 1:
+                raise ValueError("node %r has size %r, expected %r"
+                                 % (node.key, node.size, left.size + right.size + 1))
+            if abs(left.height - right.height) > 1:
+                raise ValueError("node %r has balance factor %r" % (node.key, left.height - right.height))
+            if last is not None and not last.key < node.key:
+                raise ValueError("key %r follows %r in InOrder" % (node.key, last.key))
+            if first is None:
+                first = node
+            last = node
+            count += 1
+            node = right
+        if count != self.Treesize:
+            raise ValueError("Treesize is %r but the tree has %r nodes" % (self.Treesize, count))
+        if first is None:  # an empty tree may keep None or a virtual node as min/max
+            if (self.min is not None and not self.min.isVirtual) or (self.max is not None and not self.max.isVirtual):
+                raise ValueError("empty tree has min/max %r/%r" % (getattr(self.min, "key", None), getattr(self.max, "key", None)))
+        elif self.min is not first or self.max is not last:
+            raise ValueError("min/max are %r/%r, expected %r/%r" % (
+                getattr(self.min, "key", None), getattr(self.max, "key", None),
+                getattr(first, "key", None), getattr(last, "key", None)))
+        return True
+
+    """iterates over the keys of the dictionary in ascending order
+
+    @rtype: iterator
+    @returns: a lazy iterator of keys, the tree must not be changed while it is in use
+    """
+
+    def __iter__(self):
+        # time complexity O(1) amortized per step, O(logn) memory
+        return self.keys()
+
+    """iterates over the keys of the dictionary in ascending order
+
+    @rtype: iterator
+    """
+
+    def keys(self):
+        # time complexity O(1) amortized per step, O(logn) memory
+        for node in self.iterNodes(None, None, False):
+            yield node.key
+
+    """iterates over the (key, value) pairs of the dictionary in ascending key order
+
+    @rtype: iterator
+    """
+
+    def items(self):
+        # time complexity O(1) amortized per step, O(logn) memory
+        for node in self.iterNodes(None, None, False):
+            yield (node.key, node.value)
+
+    """iterates over the keys of the dictionary in descending order
+
+    @rtype: iterator
+    """
+
+    def reversed(self):
+        # time complexity O(1) amortized per step, O(logn) memory
+        for node in self.iterNodes(None, None, True):
+            yield node.key
+
+    __reversed__ = reversed
+
+    """iterates over the (key, value) pairs with keys in the half open range [lo, hi)
+
+    @type lo: int
+    @param lo: lower bound (inclusive), None for no lower bound
+    @type hi: int
+    @param hi: upper bound (exclusive), None for no upper bound
+    @type reverse: bool
+    @param reverse: yield in descending key order if True
+    @rtype: iterator
+    @returns: a lazy iterator of (key, value) tuples, the tree must not be changed while it is in use
+    """
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # time complexity O(logn) to reach the first pair, then O(1) amortized per step
+        for node in self.iterNodes(lo, hi, reverse):
+            yield (node.key, node.value)
+
+    def iterNodes(self, lo, hi, reverse):
+        # helper generator, InOrder walk with an explicit stack of the ancestors still to visit
+        # the first descent skips every subtree outside the bound we start from
+        # time complexity O(logn + number of yielded nodes), O(logn) memory
+        stack = []
+        node = self.root
+        if not reverse:
+            while node.is_real_node():  # seek to the first key >= lo
+                if lo is None or node.key >= lo:
+                    stack.append(node)
+                    node = node.left
+                else:
+                    node = node.right
+            while stack:
+                node = stack.pop()
+                if hi is not None and node.key >= hi:
+                    return
+                yield node
+                node = node.right
+                while node.is_real_node():
+                    stack.append(node)
+                    node = node.left
+        else:
+            while node.is_real_node():  # seek to the last key < hi
+                if hi is None or node.key < hi:
+                    stack.append(node)
+                    node = node.right
+                else:
+                    node = node.left
+            while stack:
+                node = stack.pop()
+                if lo is not None and node.key < lo:
+                    return
+                yield node
+                node = node.left
+                while node.is_real_node():
+                    stack.append(node)
+                    node = node.right
+
+    """returns the node holding the k-th smallest key in the dictionary
+
+    @type k: int
+    @param k: a rank between 1 and self.size()
+    @rtype: AVLNode
+    @returns: the node of rank k, None if k is out of range
+    """
+
+    def select(self, k):
+        # walk down choosing a side by the size of the left subtree
+        # time complexity O(h) = O(logn)
+        if k < 1 or k > self.Treesize:
+            return None
+        node = self.root
+        while True:
+            leftSize = node.left.size
+            if k == leftSize + 1:
+                return node
+            elif k <= leftSize:
+                node = node.left
+            else:
+                k -= leftSize + 1
+                node = node.right
+
+    """returns the rank of key in the dictionary
+
+    @type key: int
+    @param key: a key, not necessarily in the dictionary
+    @rtype: int
+    @returns: the number of keys in the dictionary smaller than or equal to key,
+    so that select(rank(key)) is the node of key when key is in the dictionary
+    """
+
+    def rank(self, key):
+        # time complexity O(h) = O(logn) using helper function
+        return self.countBelow(key, True)
+
+    """returns the number of keys in the half open range [lo, hi)
+
+    @type lo: int
+    @param lo: lower bound (inclusive), None for no lower bound
+    @type hi: int
+    @param hi: upper bound (exclusive), None for no upper bound
+    @rtype: int
+    """
+
+    def count_range(self, lo, hi):
+        # time complexity O(h) = O(logn) using helper function
+        below = 0 if lo is None else self.countBelow(lo, False)
+        upTo = self.Treesize if hi is None else self.countBelow(hi, False)
+        return max(upTo - below, 0)
+
+    def countBelow(self, key, inclusive):
+        # helper, counts keys smaller than key (or equal to key if inclusive) on one descent
+        # time complexity O(h) = O(logn)
+        count = 0
+        node = self.root
+        while node.is_real_node():
+            if node.key < key or (inclusive and node.key == key):
+                count += node.left.size + 1  # node and its whole left subtree are below key
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    """returns the node with the maximal key in the dictionary
+
+    @rtype: AVLNode
+    @returns: the maximal node, None if the dictionary is empty
+    """
+
+    def max_node(self):
+        # time complexity O(1) return field
+        return self.max
+
+    """returns the number of items in dictionary 
+
+    @rtype: int
+    @returns: the number of items in dictionary 
+    """
+
+    def size(self):
+        # time complexity O(1) return field
+        return self.Treesize
+
+    """returns the root of the tree representing the dictionary
+
+    @rtype: AVLNode
+    @returns: the root, None if the dictionary is empty
+    """
+
+    def get_root(self):
+        # time complexity O(1) return field
+        return self.root
+
+    """returns the root of the tree representing the dictionary
+    @rtype: AVLNode
+    """
+
+
+
+"""
+Process pool helpers for the parallel_* methods of AVLTree.
+trees cross process boundaries as a (keys, values) pair of lists in ascending key order.
+"""
+
+
+def serializeTree(tree):
+    # time complexity O(n)
+    keys = []
+    values = []
+    for key, value in tree.items():
+        keys.append(key)
+        values.append(value)
+    return (keys, values)
+
+
+def deserializeTree(cls, data):
+    # time complexity O(n)
+    keys, values = data
+    return cls.from_sorted(zip(keys, values))
+
+
+def parallelSortWorker(items):
+    # sorts one part of the input by key
+    items.sort(key=lambda item: item[0])
+    return ([item[0] for item in items], [item[1] for item in items])
+
+
+def parallelUnionWorker(task):
+    # unions one pair of pieces
+    mine, theirs, merge = task
+    tree = deserializeTree(AVLTree, mine)
+    tree.union(deserializeTree(AVLTree, theirs), merge)
+    return serializeTree(tree)
+
+
+def parallelFilterWorker(task):
+    # filters one piece
+    (keys, values), predicate = task
+    kept = ([], [])
+    for key, value in zip(keys, values):
+        if predicate(key, value):
+            kept[0].append(key)
+            kept[1].append(value)
+    return kept
+
+
+"""
+Struct-of-arrays storage engine for AVL trees.
+"""
+
+
+class AVLArrayStore(object):
+    """Parallel arrays holding the nodes of one or more ArrayAVLTree objects.
+
+    node i is described by keys[i], values[i], left[i], right[i], parent[i] and height[i],
+    index 0 is the virtual node shared by every tree in the store.
+    deleted slots are kept on a free list chained through right[] and reused by newNode.
+    """
+
+    def __init__(self):
+        self.keys = [None]
+        self.values = [None]
+        self.left = array('i', [0])
+        self.right = array('i', [0])
+        self.parent = array('i', [0])
+        self.height = array('b', [-1])
+        self.size = array('i', [0])  # subtree sizes, 0 for the virtual node
+        self.freeHead = 0  # first free slot, 0 means the free list is empty
+
+    def newNode(self, key, value):
+        # allocates a detached node of height 0, reusing a free slot if possible
+        # time complexity O(1) amortized
+        i = self.freeHead
+        if i:
+            self.freeHead = self.right[i]
+            self.keys[i] = key
+            self.values[i] = value
+            self.left[i] = self.right[i] = self.parent[i] = 0
+            self.height[i] = 0
+            self.size[i] = 1
+        else:
+            i = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.left.append(0)
+            self.right.append(0)
+            self.parent.append(0)
+            self.height.append(0)
+            self.size.append(1)
+        return i
+
+    def freeNode(self, i):
+        # returns slot i to the free list, dropping its key and value references
+        # time complexity O(1)
+        self.keys[i] = self.values[i] = None
+        self.height[i] = -1
+        self.right[i] = self.freeHead
+        self.freeHead = i
+
+    def updateHeight(self, i):
+        # time complexity O(1)
+        height = self.height
+        hl = height[self.left[i]]
+        hr = height[self.right[i]]
+        height[i] = (hl if hl > hr else hr) + 1
+
+    def updateSize(self, i):
+        # time complexity O(1)
+        size = self.size
+        size[i] = size[self.left[i]] + size[self.right[i]] + 1
+
+    def balanceFactor(self, i):
+        # time complexity O(1)
+        return self.height[self.left[i]] - self.height[self.right[i]]
+
+    def findMin(self, i):
+        # gets a root index and return the index of the minimal node in this subtree
+        # time complexity O(logn)
+        left = self.left
+        if i:
+            while left[i]:
+                i = left[i]
+        return i
+
+    def findMax(self, i):
+        # gets a root index and return the index of the maximal node in this subtree
+        # time complexity O(logn)
+        right = self.right
+        if i:
+            while right[i]:
+                i = right[i]
+        return i
+
+
+class ArrayNode(object):
+    """A handle to node index of an AVLArrayStore, mirrors the read interface of AVLNode.
+
+    a handle is only valid until its node is deleted, the slot may then be reused.
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def key(self):
+        return self.store.keys[self.index]
+
+    @property
+    def value(self):
+        return self.store.values[self.index]
+
+    @value.setter
+    def value(self, value):
+        self.store.values[self.index] = value
+
+    @property
+    def height(self):
+        return self.store.height[self.index]
+
+    def is_real_node(self):
+        # time complexity O(1)
+        return self.index != 0
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayNode) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+
+"""
+A class implementing an AVL tree on top of an AVLArrayStore.
+same public interface and return values as AVLTree, nodes are returned as ArrayNode handles.
+trees that share a store can be joined in O(logn), split always keeps the store of self.
+"""
+
+
+class ArrayAVLTree(object):
+    """
+    Constructor, store is shared with other trees if given.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else AVLArrayStore()
+        self.root = 0
+        self.max = 0
+        self.min = 0
+        self.Treesize = 0
+
+    def createByRoot(self, rootIndex):
+        # specific helper function for split, same as AVLTree.createByRoot
+        # time complexity O(1)
+        if rootIndex:
+            self.root = rootIndex
+            self.store.parent[rootIndex] = 0
+            self.Treesize = self.store.size[rootIndex]
+
+    def nodeAt(self, i):
+        # wraps index i in a handle, None for the virtual node
+        # time complexity O(1)
+        return ArrayNode(self.store, i) if i else None
+
+    """builds an array AVL tree from (key, value) pairs that are already sorted by key
+
+    @type items: iterable
+    @pre: keys are distinct and appear in ascending order
+    @param items: (key, value) pairs to be stored in the tree
+    @type store: AVLArrayStore
+    @param store: store to allocate the nodes in, a new store if None
+    @rtype: ArrayAVLTree
+    @returns: a perfectly balanced ArrayAVLTree holding items
+    """
+
+    @classmethod
+    def from_sorted(cls, items, store=None):
+        # same middle-element construction as AVLTree.from_sorted
+        # time complexity O(n)
+        tree = cls(store)
+        if not isinstance(items, list):
+            items = list(items)
+        if len(items) == 0:
+            return tree
+        s = tree.store
+        parent = s.parent
+
+        def buildRec(lo, hi):
+            # inner function building items[lo..hi], returns the index of the subtree root
+            if lo > hi:
+                return 0
+            mid = (lo + hi) // 2
+            key, value = items[mid]
+            i = s.newNode(key, value)
+            l = buildRec(lo, mid - 1)
+            r = buildRec(mid + 1, hi)
+            s.left[i] = l
+            s.right[i] = r
+            if l:
+                parent[l] = i
+            if r:
+                parent[r] = i
+            s.updateHeight(i)
+            s.updateSize(i)
+            return i
+
+        tree.root = buildRec(0, len(items) - 1)
+        tree.min = s.findMin(tree.root)
+        tree.max = s.findMax(tree.root)
+        tree.Treesize = len(items)
+        return tree
+
+    """searches for a node in the dictionary corresponding to the key (starting at the root)
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (ArrayNode,int)
+    @returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
+    and e is the number of edges on the path between the starting node and ending node+1.
+    """
+
+    def search(self, key):
+        # time complexity O(h) = O(logn)
+        return self.searchFromIndex(self.root, key, 1)
+
+    def searchFromIndex(self, i, key, e):
+        # helper, regular BST search from index i downwards + e counting
+        # time complexity O(logn)
+        keys, left, right = self.store.keys, self.store.left, self.store.right
+        while i:
+            nodeKey = keys[i]
+            if nodeKey == key:
+                return (ArrayNode(self.store, i), e)
+            elif nodeKey < key:
+                i = right[i]
+            else:
+                i = left[i]
+            e += 1
+        return (None, e)
+
+    """searches for a node in the dictionary corresponding to the key, starting at the max
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (ArrayNode,int)
+    @returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
+    and e is the number of edges on the path between the starting node and ending node+1.
+    """
+
+    def finger_search(self, key):
+        # time complexity O(logn)
+        if self.root:
+            i, e = self.fingerDownwardStart(key, 1)
+            return self.searchFromIndex(i, key, e)
+        return (None, 1)
+
+    def fingerDownwardStart(self, key, e):
+        # helper for finger functions, same edge counting as AVLTree.fingerDownwardStart
+        # time complexity O(logn)
+        keys, parent = self.store.keys, self.store.parent
+        i = self.max
+        while (self.root != i) and (keys[i] > key):
+            i = parent[i]
+            e += 1
+        if ((i == self.root) and (keys[i] > key)) or (i == self.max):
+            return (i, e)
+        return (i, e - 2)
+
+    """inserts a new node into the dictionary with corresponding key and value (starting at the root)
+
+    @type key: int
+    @pre: key currently does not appear in the dictionary
+    @param key: key of item that is to be inserted to self
+    @type val: string
+    @param val: the value of the item
+    @rtype: (ArrayNode,int,int)
+    @returns: a 3-tuple (x,e,h) where x is the new node,
+    e is the number of edges on the path between the starting node and new node before rebalancing,
+    and h is the number of PROMOTE cases during the AVL rebalancing
+    """
+
+    def insert(self, key, val):
+        # time complexity O(logn)
+        i = self.store.newNode(key, val)
+        self.Treesize += 1
+        if not self.root:  # special case, tree was empty
+            self.root = self.max = self.min = i
+            return (ArrayNode(self.store, i), 1, 0)
+        return self.insertHelper(self.root, i, 2)
+
+    """inserts a new node into the dictionary with corresponding key and value, starting at the max
+
+    @type key: int
+    @pre: key currently does not appear in the dictionary
+    @param key: key of item that is to be inserted to self
+    @type val: string
+    @param val: the value of the item
+    @rtype: (ArrayNode,int,int)
+    @returns: same as insert
+    """
+
+    def finger_insert(self, key, val):
+        # time complexity O(logn)
+        i = self.store.newNode(key, val)
+        self.Treesize += 1
+        if not self.root:  # special case, tree was empty
+            self.root = self.max = self.min = i
+            return (ArrayNode(self.store, i), 1, 0)
+        current, e = self.fingerDownwardStart(key, 2)
+        return self.insertHelper(current, i, e)
+
+    def insertHelper(self, current, i, e):
+        # helper, places detached node i below current and rebalances
+        # time complexity O(logn)
+        s = self.store
+        keys, left, right = s.keys, s.left, s.right
+        key = keys[i]
+        while True:
+            if keys[current] > key:
+                if left[current]:
+                    current = left[current]
+                    e += 1
+                else:
+                    left[current] = i
+                    break
+            else:
+                if right[current]:
+                    current = right[current]
+                    e += 1
+                else:
+                    right[current] = i
+                    break
+        s.parent[i] = current
+        Hcounter = self.rotationsCheck(current, 0, True)
+        if keys[self.max] < key:
+            self.max = i
+        if keys[self.min] > key:
+            self.min = i
+        return (ArrayNode(s, i), e, Hcounter)
+
+    def rotateR(self, A):
+        # time complexity O(1)
+        s = self.store
+        left, right, parent = s.left, s.right, s.parent
+        B = left[A]
+        if self.root == A:
+            self.root = B
+        elif right[parent[A]] == A:
+            right[parent[A]] = B
+        else:
+            left[parent[A]] = B
+        parent[B] = parent[A]
+        parent[A] = B
+        left[A] = right[B]
+        if right[B]:
+            parent[right[B]] = A
+        right[B] = A
+        s.updateHeight(A)
+        s.updateSize(A)
+        s.updateHeight(B)
+        s.updateSize(B)
+
+    def rotateL(self, A):
+        # time complexity O(1)
+        s = self.store
+        left, right, parent = s.left, s.right, s.parent
+        B = right[A]
+        if self.root == A:
+            self.root = B
+        elif right[parent[A]] == A:
+            right[parent[A]] = B
+        else:
+            left[parent[A]] = B
+        parent[B] = parent[A]
+        parent[A] = B
+        right[A] = left[B]
+        if left[B]:
+            parent[left[B]] = A
+        left[B] = A
+        s.updateHeight(A)
+        s.updateSize(A)
+        s.updateHeight(B)
+        s.updateSize(B)
+
+    def rotationsCheck(self, current, Hcounter, insert):
+        # same rebalancing walk as AVLTree.rotationsCheck, on indices
+        # time complexity O(logn)
+        s = self.store
+        left, right, parent, height = s.left, s.right, s.parent, s.height
+        while current:
+            previousHeight = height[current]
+            s.updateHeight(current)
+            s.updateSize(current)
+            BF = height[left[current]] - height[right[current]]
+            if (previousHeight == height[current]) and (abs(BF) < 2):  # case 1
+                break
+            elif abs(BF) < 2:  # case 2
+                Hcounter += 1
+                current = parent[current]
+            else:  # case 3
+                temp = parent[current]
+                if BF == 2:
+                    if s.balanceFactor(left[current]) == -1:
+                        self.rotateL(left[current])
+                    self.rotateR(current)
+                else:
+                    if s.balanceFactor(right[current]) == 1:
+                        self.rotateR(right[current])
+                    self.rotateL(current)
+                if insert:
+                    break
+                current = temp
+        while current:  # sizes change all the way up to the root
+            s.updateSize(current)
+            current = parent[current]
+        return Hcounter
+
+    """deletes node from the dictionary
+
+    @type node: ArrayNode
+    @pre: node is a real pointer to a node in self
+    """
+
+    def delete(self, node):
+        # time complexity O(logn)
+        s = self.store
+        left, right, parent = s.left, s.right, s.parent
+        i = node.index
+        if self.max == i:
+            self.max = self.predecessor(i)
+        if self.min == i:
+            self.min = self.successor(i)
+        self.Treesize -= 1
+        p = parent[i]
+        if not (left[i] or right[i]):  # no sons case
+            if p and left[p] == i:
+                left[p] = 0
+            elif p and right[p] == i:
+                right[p] = 0
+            else:
+                self.root = 0
+            current = p
+        elif not left[i]:  # has only right son
+            self.replaceChild(i, p, right[i])
+            current = p
+        elif not right[i]:  # has only left son
+            self.replaceChild(i, p, left[i])
+            current = p
+        else:  # has two sons
+            successorNode = self.successor(i)
+            s.height[successorNode] = s.height[i]
+            if right[i] == successorNode:
+                current = successorNode
+                left[successorNode] = left[i]
+                parent[left[i]] = successorNode
+                self.replaceChild(i, p, successorNode)
+            else:
+                current = parent[successorNode]
+                left[current] = right[successorNode]
+                if right[successorNode]:
+                    parent[right[successorNode]] = current
+                left[successorNode] = left[i]
+                right[successorNode] = right[i]
+                parent[right[i]] = successorNode
+                parent[left[i]] = successorNode
+                self.replaceChild(i, p, successorNode)
+        self.rotationsCheck(current, 0, False)
+        s.freeNode(i)
+
+    def replaceChild(self, i, father, sub):
+        # helper, same as AVLTree.selectedNode_father_sub_connection
+        # time complexity O(1)
+        s = self.store
+        if father and s.left[father] == i:
+            s.left[father] = sub
+            s.parent[sub] = father
+        elif father and s.right[father] == i:
+            s.right[father] = sub
+            s.parent[sub] = father
+        else:  # is root
+            s.parent[sub] = 0
+            self.root = sub
+
+    def successor(self, i):
+        # time complexity O(logn)
+        s = self.store
+        if s.right[i]:
+            return s.findMin(s.right[i])
+        prev, i = i, s.parent[i]
+        while i and prev == s.right[i]:
+            prev, i = i, s.parent[i]
+        return i
+
+    def predecessor(self, i):
+        # time complexity O(logn)
+        s = self.store
+        if s.left[i]:
+            return s.findMax(s.left[i])
+        prev, i = i, s.parent[i]
+        while i and prev == s.left[i]:
+            prev, i = i, s.parent[i]
+        return i
+
+    """joins self with item and another ArrayAVLTree
+
+    @type tree2: ArrayAVLTree
+    @param tree2: a dictionary to be joined with self, its nodes are moved into self.store
+    if the stores differ (O(size of tree2) in that case)
+    @type key: int
+    @param key: the key separting self and tree2
+    @type val: string
+    @param val: the value corresponding to key
+    @pre: all keys in self are smaller than key and all keys in tree2 are larger than key,
+    or the opposite way
+    """
+
+    def join(self, tree2, key, val):
+        # time complexity O(logn)
+        if tree2.store is not self.store:
+            tree2 = ArrayAVLTree.from_sorted(tree2.avl_to_array(), self.store)
+        self.joinNode(tree2, self.store.newNode(key, val))
+
+    def joinNode(self, tree2, x):
+        # helper, join using the already allocated detached node x as the mediator
+        # time complexity O(logn)
+        s = self.store
+        s.left[x] = s.right[x] = s.parent[x] = 0
+        s.height[x] = 0
+        s.size[x] = 1
+        self.Treesize += tree2.Treesize + 1
+        h1, h2 = s.height[self.root], s.height[tree2.root]
+        if h2 < h1:
+            self.genericJoin(self, tree2, x)
+        elif h2 > h1:
+            self.genericJoin(tree2, self, x)
+            self.root = tree2.root
+        elif self.root:
+            self.genericJoin(tree2, self, x)
+            self.root = x
+        else:  # special case, both trees are empty
+            self.root = self.max = self.min = x
+        s.updateHeight(x)
+        s.updateSize(x)
+        self.rotationsCheck(s.parent[x], 0, False)
+
+    def genericJoin(self, big, small, x):
+        # same as AVLTree.genericJoin, on indices
+        # time complexity O(logn)
+        s = self.store
+        keys, left, right, parent, height = s.keys, s.left, s.right, s.parent, s.height
+        hSmall = height[small.root]
+        current = big.root
+        if not small.root:  # special case, small is an empty tree
+            height[x] = 0
+            if keys[x] > keys[big.root]:
+                maxNode = s.findMax(big.root)
+                parent[x] = maxNode
+                right[maxNode] = x
+                self.max = x
+                self.min = big.min
+            else:
+                minNode = s.findMin(big.root)
+                parent[x] = minNode
+                left[minNode] = x
+                self.min = x
+                self.max = big.max
+        elif keys[big.root] > keys[x]:  # small will be in the left subtree
+            self.min = small.min
+            self.max = big.max
+            left[x] = small.root
+            parent[small.root] = x
+            while height[current] > hSmall and left[current]:
+                current = left[current]
+            if height[current] > hSmall:
+                left[current] = x
+                parent[x] = current
+            else:
+                right[x] = current
+                parent[x] = parent[current]
+                if parent[current]:
+                    left[parent[current]] = x
+                parent[current] = x
+        else:  # small will be in the right subtree
+            self.min = big.min
+            self.max = small.max
+            right[x] = small.root
+            parent[small.root] = x
+            while height[current] > hSmall and right[current]:
+                current = right[current]
+            if height[current] > hSmall:
+                right[current] = x
+                parent[x] = current
+            else:
+                left[x] = current
+                parent[x] = parent[current]
+                if parent[current]:
+                    right[parent[current]] = x
+                parent[current] = x
+
+    """splits the dictionary at a given node
+
+    @type node: ArrayNode
+    @pre: node is in self
+    @param node: the node in the dictionary to be used for the split
+    @rtype: (ArrayAVLTree, ArrayAVLTree)
+    @returns: a tuple (left, right) of trees sharing self.store, holding the keys
+    smaller than node.key and larger than node.key, node can still be read
+    """
+
+    def split(self, node):
+        # ancestors are reused as join mediators, so no node is allocated. the slot of node
+        # is not freed, so it keeps its key and value like the node of AVLTree.split
+        # time complexity O(logn)
+        s = self.store
+        left, right, parent = s.left, s.right, s.parent
+        i = node.index
+        smallerTree = ArrayAVLTree(s)
+        smallerTree.createByRoot(left[i])
+        biggerTree = ArrayAVLTree(s)
+        biggerTree.createByRoot(right[i])
+        p = parent[i]
+        while p:
+            grand = parent[p]
+            uniteTree = ArrayAVLTree(s)
+            if right[p] == i:  # smaller values tree accumulation
+                uniteTree.createByRoot(left[p])
+                smallerTree.joinNode(uniteTree, p)
+            else:  # bigger values tree accumulation
+                uniteTree.createByRoot(right[p])
+                biggerTree.joinNode(uniteTree, p)
+            i, p = p, grand
+        i = node.index  # stays allocated and readable, as node of AVLTree.split, but detached
+        left[i] = right[i] = parent[i] = 0
+        smallerTree.max = s.findMax(smallerTree.root)
+        smallerTree.min = s.findMin(smallerTree.root)
+        biggerTree.max = s.findMax(biggerTree.root)
+        biggerTree.min = s.findMin(biggerTree.root)
+        return smallerTree, biggerTree
+
+    """returns an array representing dictionary
+
+    @rtype: list
+    @returns: a sorted list according to key of touples (key, value) representing the data structure
+    """
+
+    def avl_to_array(self):
+        # InOrder walk with an explicit stack
+        # time complexity O(n)
+        s = self.store
+        keys, values, left, right = s.keys, s.values, s.left, s.right
+        res = []
+        stack = []
+        i = self.root
+        while stack or i:
+            while i:
+                stack.append(i)
+                i = left[i]
+            i = stack.pop()
+            res.append((keys[i], values[i]))
+            i = right[i]
+        return res
+
+    def max_node(self):
+        # time complexity O(1)
+        return self.nodeAt(self.max)
+
+    def size(self):
+        # time complexity O(1)
+        return self.Treesize
+
+    def get_root(self):
+        # time complexity O(1)
+        return self.nodeAt(self.root)
+
+
+
+"""
+A persistent (path copying) AVL tree.
+"""
+
+
+class PersistentNode(object):
+    """An immutable node of a PersistentAVLTree, None stands for the virtual node.
+
+    nodes have no parent pointer, so a node may be shared by any number of versions.
+    """
+
+    __slots__ = ('key', 'value', 'left', 'right', 'height', 'size')
+
+    def __init__(self, key, value, left, right):
+        self.key = key
+        self.value = value
+        self.left = left
+        self.right = right
+        hl = left.height if left is not None else -1
+        hr = right.height if right is not None else -1
+        self.height = (hl if hl > hr else hr) + 1
+        self.size = (left.size if left is not None else 0) + (right.size if right is not None else 0) + 1
+
+    def is_real_node(self):
+        # time complexity O(1)
+        return True
+
+
+def persistentHeight(node):
+    # time complexity O(1)
+    return node.height if node is not None else -1
+
+
+def persistentBalance(key, value, left, right):
+    # builds the node (key, value, left, right) when the heights of left and right differ by
+    # at most 2, applying the single or double rotation that fixes it. only new nodes are created
+    # time complexity O(1)
+    hl, hr = persistentHeight(left), persistentHeight(right)
+    if hl > hr + 1:
+        if persistentHeight(left.left) >= persistentHeight(left.right):  # single right rotation
+            return PersistentNode(left.key, left.value, left.left,
+                                  PersistentNode(key, value, left.right, right))
+        lr = left.right  # double rotation
+        return PersistentNode(lr.key, lr.value,
+                              PersistentNode(left.key, left.value, left.left, lr.left),
+                              PersistentNode(key, value, lr.right, right))
+    if hr > hl + 1:
+        if persistentHeight(right.right) >= persistentHeight(right.left):  # single left rotation
+            return PersistentNode(right.key, right.value,
+                                  PersistentNode(key, value, left, right.left), right.right)
+        rl = right.left  # double rotation
+        return PersistentNode(rl.key, rl.value,
+                              PersistentNode(key, value, left, rl.left),
+                              PersistentNode(right.key, right.value, rl.right, right.right))
+    return PersistentNode(key, value, left, right)
+
+
+def persistentJoin(left, key, value, right):
+    # joins two trees and a mediator, copying only the spine of the taller tree
+    # time complexity O(|height(left) - height(right)| + 1)
+    hl, hr = persistentHeight(left), persistentHeight(right)
+    if hl > hr + 1:
+        return persistentBalance(left.key, left.value, left.left,
+                                 persistentJoin(left.right, key, value, right))
+    if hr > hl + 1:
+        return persistentBalance(right.key, right.value,
+                                 persistentJoin(left, key, value, right.left), right.right)
+    return PersistentNode(key, value, left, right)
+
+
+"""
+A class implementing a persistent AVL tree.
+every update copies the O(logn) nodes on its path and leaves all older versions intact,
+so snapshot() is O(1) and a snapshot can be read by any thread without locking while the
+tree keeps changing.
+"""
+
+
+class PersistentAVLTree(object):
+    """
+    Constructor, root is the PersistentNode of an existing version (None for an empty tree).
+    """
+
+    def __init__(self, root=None, frozen=False):
+        self.root = root
+        self.frozen = frozen
+
+    def checkWritable(self):
+        # time complexity O(1)
+        if self.frozen:
+            raise TypeError("a snapshot of a PersistentAVLTree is read-only")
+
+    """returns an immutable version of the dictionary as it is now
+
+    @rtype: PersistentAVLTree
+    @returns: a read-only tree sharing all of its nodes with self
+    """
+
+    def snapshot(self):
+        # time complexity O(1)
+        return PersistentAVLTree(self.root, True)
+
+    """searches for a node in the dictionary corresponding to the key (starting at the root)
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (PersistentNode,int)
+    @returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
+    and e is the number of edges on the path between the starting node and ending node+1.
+    """
+
+    def search(self, key):
+        # time complexity O(logn)
+        node = self.root
+        e = 1
+        while node is not None:
+            if node.key == key:
+                return (node, e)
+            node = node.right if node.key < key else node.left
+            e += 1
+        return (None, e)
+
+    """inserts a new node into the dictionary with corresponding key and value
+
+    @type key: int
+    @pre: key currently does not appear in the dictionary
+    @param key: key of item that is to be inserted to self
+    @type val: string
+    @param val: the value of the item
+    @rtype: (PersistentNode,int,int)
+    @returns: a 3-tuple (x,e,h) as in AVLTree.insert
+    """
+
+    def insert(self, key, val):
+        # the search path is recorded and copied bottom-up, rebalancing on the way
+        # time complexity O(logn)
+        self.checkWritable()
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            node = node.left if node.key > key else node.right
+        newNode = PersistentNode(key, val, None, None)
+        child = newNode
+        Hcounter = 0
+        for node in reversed(path):
+            if node.key > key:
+                copy = persistentBalance(node.key, node.value, child, node.right)
+            else:
+                copy = persistentBalance(node.key, node.value, node.left, child)
+            if copy.height > node.height and copy.key == node.key:  # grew without a rotation
+                Hcounter += 1
+            child = copy
+        self.root = child
+        return (newNode, len(path) + 1, Hcounter)
+
+    """deletes node from the dictionary
+
+    @type node: PersistentNode
+    @pre: a node with key node.key is in self
+    """
+
+    def delete(self, node):
+        # time complexity O(logn)
+        self.checkWritable()
+        self.root = self.deleteRec(self.root, node.key)
+
+    def deleteRec(self, node, key):
+        # helper, returns a copy of the subtree of node without key
+        # recursion depth O(logn)
+        if node.key > key:
+            return persistentBalance(node.key, node.value, self.deleteRec(node.left, key), node.right)
+        if node.key < key:
+            return persistentBalance(node.key, node.value, node.left, self.deleteRec(node.right, key))
+        if node.left is None:
+            return node.right
+        if node.right is None:
+            return node.left
+        successor = node.right
+        while successor.left is not None:
+            successor = successor.left
+        return persistentBalance(successor.key, successor.value, node.left,
+                                 self.deleteRec(node.right, successor.key))
+
+    """joins self with item and another PersistentAVLTree
+
+    @type tree2: PersistentAVLTree
+    @param tree2: a dictionary to be joined with self, it is not changed
+    @type key: int
+    @param key: the key separting self and tree2
+    @type val: string
+    @param val: the value corresponding to key
+    @pre: all keys in self are smaller than key and all keys in tree2 are larger than key,
+    or the opposite way
+    """
+
+    def join(self, tree2, key, val):
+        # time complexity O(logn)
+        self.checkWritable()
+        if tree2.root is not None:
+            tree2Smaller = tree2.root.key < key
+        else:  # special case, tree2 is empty, key goes on the side of self it belongs to
+            tree2Smaller = self.root is not None and self.root.key > key
+        if tree2Smaller:
+            self.root = persistentJoin(tree2.root, key, val, self.root)
+        else:
+            self.root = persistentJoin(self.root, key, val, tree2.root)
+
+    """splits the dictionary at a given node
+
+    @type node: PersistentNode
+    @pre: a node with key node.key is in self
+    @rtype: (PersistentAVLTree, PersistentAVLTree)
+    @returns: a tuple (left, right) of the keys smaller and larger than node.key,
+    self is not changed
+    """
+
+    def split(self, node):
+        # time complexity O(logn)
+        smaller, bigger = self.splitRec(self.root, node.key)
+        return PersistentAVLTree(smaller), PersistentAVLTree(bigger)
+
+    def splitRec(self, node, key):
+        # helper, returns the roots of the keys smaller and larger than key under node
+        # recursion depth O(logn)
+        if node is None:
+            return None, None
+        if node.key > key:
+            smaller, bigger = self.splitRec(node.left, key)
+            return smaller, persistentJoin(bigger, node.key, node.value, node.right)
+        if node.key < key:
+            smaller, bigger = self.splitRec(node.right, key)
+            return persistentJoin(node.left, node.key, node.value, smaller), bigger
+        return node.left, node.right
+
+    """iterates over the (key, value) pairs of the dictionary in ascending key order
+
+    @rtype: iterator
+    @returns: a lazy iterator over the version that was current when it was created,
+    later updates of self are not seen
+    """
+
+    def items(self):
+        # time complexity O(1) amortized per step, O(logn) memory
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield (node.key, node.value)
+            node = node.right
+
+    def __iter__(self):
+        # iterates over the keys in ascending order
+        for key, _ in self.items():
+            yield key
+
+    def avl_to_array(self):
+        # time complexity O(n)
+        return list(self.items())
+
+    def max_node(self):
+        # time complexity O(logn), nodes are shared between versions so max is not cached
+        node = self.root
+        while node is not None and node.right is not None:
+            node = node.right
+        return node
+
+    def size(self):
+        # time complexity O(1)
+        return self.root.size if self.root is not None else 0
+
+    def get_root(self):
+        # time complexity O(1)
+        return self.root
+
+
+
+"""
+Thread safe access to an AVLTree.
+"""
+
+
+class ReadWriteLock(object):
+    """Any number of readers or a single writer.
+
+    a waiting writer stops new readers from entering, so a stream of reads cannot starve writes.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waitingWriters = 0
+
+    def acquireRead(self):
+        with self.cond:
+            while self.writer or self.waitingWriters:
+                self.cond.wait()
+            self.readers += 1
+
+    def releaseRead(self):
+        with self.cond:
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquireWrite(self):
+        with self.cond:
+            self.waitingWriters += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waitingWriters -= 1
+            self.writer = True
+
+    def releaseWrite(self):
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+
+class ExclusiveLock(object):
+    """One plain lock behind the interface of ReadWriteLock, readers exclude each other too.
+
+    the methods are the bound methods of the lock, so taking it costs no Python level call.
+    """
+
+    def __init__(self):
+        lock = threading.Lock()
+        self.acquireRead = self.acquireWrite = lock.acquire
+        self.releaseRead = self.releaseWrite = lock.release
+
+
+class WriteRequest(object):
+    """A write waiting in ConcurrentAVLTree.pending for the next batch."""
+
+    __slots__ = ('apply', 'args', 'done', 'result', 'error')
+
+    def __init__(self, apply, args):
+        self.apply = apply
+        self.args = args
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+"""
+A class wrapping an AVLTree for use from many threads.
+with shared reads, readers share the tree and never block each other. writers queue their requests
+and whichever writer gets the combine lock first applies queued requests, until none is left, as one
+batch under a single exclusive section. each call still returns only after its own write was applied.
+without shared reads (the default when the GIL is enabled, where readers cannot run side by side
+anyway) every call takes one plain lock and a write is applied at once, as a batch of one.
+
+consistency: a read sees every write of the batches completed before it and nothing of a batch
+in progress. max_node, size and search calls made inside one read() block see the same state.
+nodes returned by reads must not be used to change the tree, and the sticky finger and lookup
+cache of the wrapped tree must stay disabled as they change state on reads.
+"""
+
+
+class ConcurrentAVLTree(object):
+    """
+    Constructor, wraps tree (a new empty AVLTree if None), tree must not be used directly afterwards.
+    shared_reads picks the reader/writer lock and batched writes, None picks it only on a
+    free-threaded build.
+    """
+
+    def __init__(self, tree=None, shared_reads=None):
+        self.tree = tree if tree is not None else AVLTree()
+        if shared_reads is None:
+            shared_reads = not getattr(sys, "_is_gil_enabled", lambda: True)()
+        self.shared_reads = shared_reads
+        self.lock = ReadWriteLock() if shared_reads else ExclusiveLock()
+        self.combineLock = threading.Lock()
+        self.pendingLock = threading.Lock()
+        self.pending = deque()
+        self.batches = 0  # number of exclusive sections, for comparing against number of writes
+
+    """gives consistent access to several read operations
+
+    @rtype: AVLTree
+    @returns: a context manager holding the read lock and yielding the wrapped tree,
+    which must only be read inside the block
+    """
+
+    @contextmanager
+    def read(self):
+        self.lock.acquireRead()
+        try:
+            yield self.tree
+        finally:
+            self.lock.releaseRead()
+
+    def search(self, key):
+        # time complexity O(logn)
+        self.lock.acquireRead()
+        try:
+            return self.tree.search(key)
+        finally:
+            self.lock.releaseRead()
+
+    def finger_search(self, key):
+        # time complexity O(logn)
+        self.lock.acquireRead()
+        try:
+            return self.tree.finger_search(key)
+        finally:
+            self.lock.releaseRead()
+
+    def max_node(self):
+        # time complexity O(1)
+        with self.read() as tree:
+            return tree.max_node()
+
+    def size(self):
+        # time complexity O(1)
+        with self.read() as tree:
+            return tree.size()
+
+    def avl_to_array(self):
+        # time complexity O(n), blocks writers for the whole walk
+        with self.read() as tree:
+            return tree.avl_to_array()
+
+    def insert(self, key, val):
+        # returns (x, e, h) as AVLTree.insert
+        return self.write(AVLTree.insert, (key, val))
+
+    def finger_insert(self, key, val):
+        # returns (x, e, h) as AVLTree.finger_insert
+        return self.write(AVLTree.finger_insert, (key, val))
+
+    """deletes the node of key from the dictionary
+
+    @type key: int
+    @param key: key to be deleted, nodes cannot be held safely between calls so a key is used
+    @rtype: bool
+    @returns: True if key was found and deleted
+    """
+
+    def delete(self, key):
+        return self.write(ConcurrentAVLTree.deleteKey, (key,))
+
+    @staticmethod
+    def deleteKey(tree, key):
+        # time complexity O(logn)
+        return tree.delete_key(key)
+
+    def write(self, apply, args):
+        # queues the request, then either applies the current batch or finds it applied
+        # by the writer that held the combine lock before
+        if not self.shared_reads:  # one lock for everything, nothing to wait for but the lock
+            self.lock.acquireWrite()
+            try:
+                self.batches += 1
+                return apply(self.tree, *args)
+            finally:
+                self.lock.releaseWrite()
+        request = WriteRequest(apply, args)
+        with self.pendingLock:
+            self.pending.append(request)
+        with self.combineLock:
+            if not request.done:
+                self.applyPending()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def applyPending(self):
+        # helper, applies queued requests in one exclusive section until the queue stays empty,
+        # so the writes queued while a batch is applied join it. combineLock is held
+        self.lock.acquireWrite()
+        try:
+            while True:
+                with self.pendingLock:
+                    batch = list(self.pending)
+                    self.pending.clear()
+                if not batch:
+                    break
+                for request in batch:
+                    try:
+                        request.result = request.apply(self.tree, *request.args)
+                    except Exception as error:  # reported to the thread that made the request
+                        request.error = error
+                    request.done = True
+            self.batches += 1
+        finally:
+            self.lock.releaseWrite()
+
+
+
+"""
+Access to an AVLTree from asyncio code without stalling the event loop.
+"""
+
+
+class AsyncAVLTree(object):
+    """
+    Constructor, wraps tree (a new empty AVLTree if None), tree must not be used directly afterwards.
+    long operations hand control back to the loop every chunk nodes, or run whole in executor
+    (a concurrent.futures executor, or "default" for the loop's default one) when it is given.
+    point operations run at once, writes wait for a long write (or any executor work) in progress.
+    """
+
+    def __init__(self, tree=None, chunk=1024, executor=None):
+        self.tree = tree if tree is not None else AVLTree()
+        self.chunk = chunk
+        self.executor = executor
+        self.lock = asyncio.Lock()  # held by writes and long operations
+        self.offloaded = False  # the tree is in use by an executor thread, reads must wait too
+
+    async def search(self, key):
+        # returns (x, e) as AVLTree.search
+        if self.offloaded:
+            async with self.lock:
+                return self.tree.search(key)
+        return self.tree.search(key)
+
+    async def finger_search(self, key):
+        # returns (x, e) as AVLTree.finger_search
+        if self.offloaded:
+            async with self.lock:
+                return self.tree.finger_search(key)
+        return self.tree.finger_search(key)
+
+    async def insert(self, key, val):
+        # returns (x, e, h) as AVLTree.insert
+        async with self.lock:
+            return self.tree.insert(key, val)
+
+    async def delete(self, node):
+        async with self.lock:
+            self.tree.delete(node)
+
+    async def delete_key(self, key):
+        # returns True if key was found and deleted
+        async with self.lock:
+            return self.tree.delete_key(key)
+
+    def size(self):
+        return self.tree.size()
+
+    """iterates over the (key, value) pairs with keys in [lo, hi), giving the loop a turn every chunk pairs
+
+    @rtype: async iterator
+    @returns: pairs as AVLTree.range, writes made while it is suspended are seen past the last pair
+    """
+
+    async def range(self, lo=None, hi=None, reverse=False):
+        # the walk holds no lock, so writes go on between chunks. when the keys change while it is
+        # suspended the walk starts again from the last yielded key, on the changed tree
+        # time complexity as AVLTree.range, plus O(logn) per change seen
+        tree = self.tree
+        nodes = tree.iterNodes(lo, hi, reverse)
+        version = tree.version
+        count = 0
+        resumed = False  # a forward walk started again at the last yielded key, which is skipped
+        while True:
+            node = next(nodes, None)
+            if node is None:
+                return
+            if resumed:
+                resumed = False
+                if node.key == key:
+                    continue
+            key = node.key
+            yield (key, node.value)
+            count += 1
+            if count == self.chunk:
+                count = 0
+                await asyncio.sleep(0)
+            if self.offloaded:  # an executor thread owns the tree, wait until it is done
+                async with self.lock:
+                    pass
+            if tree.version != version:  # the caller or another task may have awaited a write
+                version = tree.version
+                if reverse:
+                    nodes = tree.iterNodes(lo, key, True)
+                else:
+                    nodes = tree.iterNodes(key, hi, False)
+                    resumed = True
+
+    def __aiter__(self):
+        return self.range()
+
+    async def avl_to_array(self):
+        # time complexity O(n), in chunks or in the executor
+        if self.executor is not None:
+            return await self.offload(self.tree.avl_to_array)
+        async with self.lock:  # writes wait instead of ending the walk
+            return [item async for item in self.range()]
+
+    """inserts a batch of items, see AVLTree.insert_many
+
+    @rtype: (int,int,int)
+    @returns: same as AVLTree.insert_many
+    """
+
+    async def insert_many(self, pairs):
+        # one insert_many per chunk, with a loop turn in between
+        if self.executor is not None:
+            return await self.offload(self.tree.insert_many, pairs)
+        return await self.chunked(self.tree.insert_many, sorted(pairs, key=lambda item: item[0]))
+
+    """deletes a batch of keys, see AVLTree.delete_many
+
+    @rtype: (int,int,int)
+    @returns: same as AVLTree.delete_many
+    """
+
+    async def delete_many(self, keys):
+        if self.executor is not None:
+            return await self.offload(self.tree.delete_many, keys)
+        return await self.chunked(self.tree.delete_many, sorted(keys))
+
+    async def chunked(self, apply, batch):
+        # helper, applies apply to every chunk of batch holding the lock, summing the 3-tuples.
+        # chunks are small against the tree so insert_many and delete_many take the finger path
+        total = [0, 0, 0]
+        async with self.lock:
+            for start in range(0, len(batch), self.chunk):
+                for i, count in enumerate(apply(batch[start:start + self.chunk])):
+                    total[i] += count
+                await asyncio.sleep(0)
+        return tuple(total)
+
+    """runs a method of the wrapped tree in the executor, e.g. split, join or union
+
+    @type method: str
+    @param method: name of an AVLTree method
+    @returns: the result of the method
+    """
+
+    async def call(self, method, *args):
+        return await self.offload(getattr(self.tree, method), *args)
+
+    async def offload(self, func, *args):
+        # helper, runs func(*args) in the executor (or in the loop if there is none) while
+        # every other access to the tree waits
+        async with self.lock:
+            if self.executor is None:
+                return func(*args)
+            executor = None if self.executor == "default" else self.executor
+            self.offloaded = True
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            finally:
+                self.offloaded = False
+
+
+"""
+An AVLTree of half open intervals [start, end) with overlap queries.
+"""
+
+
+class IntervalAVLTree(AVLTree):
+    """
+    Constructor, keys are (start, end) tuples so intervals are ordered by start, then end.
+    every node keeps in agg the maximal end in its subtree, through the aggregate hooks of AVLTree,
+    so the subtrees holding no interval that ends after a query starts are skipped.
+    """
+
+    def __init__(self, sticky=False, mode=None):
+        AVLTree.__init__(self, sticky, mode)
+        self.monoid = (max, None)  # turns the aggregate hooks on, updateAggregate is replaced
+
+    @classmethod
+    def from_sorted(cls, items):
+        # time complexity O(n)
+        tree = super(IntervalAVLTree, cls).from_sorted(items)
+        tree.recomputeAggregates()
+        return tree
+
+    def enable_aggregate(self, combine, identity):
+        raise TypeError("the aggregate of an IntervalAVLTree is the maximal end of its intervals")
+
+    def aggregate(self, lo=None, hi=None):
+        # agg holds maximal ends, not values, so AVLTree.aggregate would mix the two
+        raise TypeError("an IntervalAVLTree has no value aggregates, use overlapping or stab")
+
+    def createNode(self, key, val):
+        # time complexity O(1)
+        node = AVLTree.createNode(self, key, val)
+        node.agg = key[1]
+        return node
+
+    def updateAggregate(self, node):
+        # helper, the maximal end under node
+        # time complexity O(1)
+        end = node.key[1]
+        if not node.left.isVirtual and node.left.agg > end:
+            end = node.left.agg
+        if not node.right.isVirtual and node.right.agg > end:
+            end = node.right.agg
+        node.agg = end
+
+    """inserts the interval [start, end) with value val
+
+    @pre: (start, end) is not in the dictionary, unless self has a mode
+    @rtype: (AVLNode,int,int)
+    @returns: same as AVLTree.insert, with key (start, end)
+    """
+
+    def add(self, start, end, val):
+        return self.insert((start, end), val)
+
+    """iterates over the intervals overlapping [lo, hi), in ascending order
+
+    @type lo: int
+    @type hi: int
+    @rtype: iterator
+    @returns: a lazy iterator of (start, end, value) with start < hi and end > lo,
+    the tree must not be changed while it is in use
+    """
+
+    def overlapping(self, lo, hi):
+        # time complexity O(logn) to the first interval, O((k + 1) * logn) for k intervals
+        return self.overlapNodes(lo, hi, False)
+
+    """iterates over the intervals holding point, in ascending order
+
+    @type point: int
+    @rtype: iterator
+    @returns: a lazy iterator of (start, end, value) with start <= point < end
+    """
+
+    def stab(self, point):
+        # time complexity as overlapping
+        return self.overlapNodes(point, point, True)
+
+    def overlapNodes(self, lo, hi, inclusive):
+        # helper generator, InOrder walk that only enters subtrees whose maximal end is > lo
+        # and stops at the first start past hi (or at hi unless inclusive)
+        stack = []
+        node = self.root
+        while True:
+            while not node.isVirtual and node.agg > lo:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            start, end = node.key
+            if start > hi or (start == hi and not inclusive):
+                return
+            if end > lo:
+                yield (start, end, node.value)
+            node = node.right
+
+
+"""
+An AVLTree over keys that are not ordered by < on themselves.
+"""
+
+
+class KeyedAVLTree(object):
+    """
+    Constructor, at most one of keytype, key and cmp may be given.
+    keytype - int, float, bytes or str, keys must all be of exactly this type and are stored as is,
+    so every comparison stays a C level comparison of two primitives. the type is checked by the
+    inserting methods only, lookups are bound straight to the wrapped tree and cost what they
+    cost on a plain AVLTree (with no keytype, key or cmp too).
+    key - a function of a key returning its sort key, keys are stored as (key(k), k) so keys with
+    equal sort keys are ordered by themselves.
+    cmp - a comparison function of two keys returning a negative, zero or positive int.
+    options are passed to the wrapped AVLTree. Nodes returned by the methods below hold the stored
+    form of their key, key_of(node) gives the key back.
+    """
+
+    KEYTYPES = (int, float, bytes, str)
+    # methods taken from the wrapped tree as they are when keys are stored as is
+    DIRECT = ("search", "finger_search", "delete_key", "delete_range", "count_range", "rank",
+              "aggregate", "range")
+
+    def __init__(self, keytype=None, key=None, cmp=None, **options):
+        if len([given for given in (keytype, key, cmp) if given is not None]) > 1:
+            raise ValueError("at most one of keytype, key and cmp may be given")
+        if keytype is not None and keytype not in self.KEYTYPES:
+            raise ValueError("unsupported keytype %r" % (keytype,))
+        self.tree = AVLTree(**options)
+        self.keytype = keytype
+        if key is not None:
+            self.encode = lambda k: (key(k), k)
+            self.decode = lambda stored: stored[1]
+        elif cmp is not None:
+            self.encode = cmp_to_key(cmp)
+            self.decode = lambda stored: stored.obj
+        else:  # keys are stored as is, lookups skip the wrapper
+            self.encode = self.decode = None
+            for name in self.DIRECT:
+                setattr(self, name, getattr(self.tree, name))
+
+    def encodeKey(self, key):
+        # helper, the stored form of key, checks the type of typed keys
+        # time complexity O(1) plus the key function
+        if self.encode is not None:
+            return self.encode(key)
+        if self.keytype is not None and type(key) is not self.keytype:
+            raise TypeError("key %r is not of type %s" % (key, self.keytype.__name__))
+        return key
+
+    def encodeBound(self, key):
+        # helper, encodeKey keeping None (no bound)
+        return None if key is None else self.encodeKey(key)
+
+    def key_of(self, node):
+        # time complexity O(1)
+        return node.key if self.decode is None else self.decode(node.key)
+
+    def insert(self, key, val):
+        # returns (x, e, h) as AVLTree.insert
+        if self.encode is None:  # the typed path, checked inline instead of through encodeKey
+            if self.keytype is not None and type(key) is not self.keytype:
+                raise TypeError("key %r is not of type %s" % (key, self.keytype.__name__))
+            return self.tree.insert(key, val)
+        return self.tree.insert(self.encode(key), val)
+
+    def finger_insert(self, key, val):
+        # returns (x, e, h) as AVLTree.finger_insert
+        return self.tree.finger_insert(self.encodeKey(key), val)
+
+    def insert_many(self, pairs):
+        # returns (k, e, h) as AVLTree.insert_many
+        return self.tree.insert_many([(self.encodeKey(key), val) for key, val in pairs])
+
+    def search(self, key):
+        # returns (x, e) as AVLTree.search
+        return self.tree.search(self.encodeKey(key))
+
+    def finger_search(self, key):
+        # returns (x, e) as AVLTree.finger_search
+        return self.tree.finger_search(self.encodeKey(key))
+
+    def delete(self, node):
+        self.tree.delete(node)
+
+    def delete_key(self, key):
+        # returns True if key was found and deleted
+        return self.tree.delete_key(self.encodeKey(key))
+
+    def delete_range(self, lo=None, hi=None):
+        # returns the number of deleted keys in [lo, hi)
+        return self.tree.delete_range(self.encodeBound(lo), self.encodeBound(hi))
+
+    def count_range(self, lo, hi):
+        return self.tree.count_range(self.encodeBound(lo), self.encodeBound(hi))
+
+    def rank(self, key):
+        return self.tree.rank(self.encodeKey(key))
+
+    def select(self, k):
+        return self.tree.select(k)
+
+    def aggregate(self, lo=None, hi=None):
+        return self.tree.aggregate(self.encodeBound(lo), self.encodeBound(hi))
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # (key, value) pairs with keys in [lo, hi), as AVLTree.range
+        for node in self.tree.iterNodes(self.encodeBound(lo), self.encodeBound(hi), reverse):
+            yield (self.key_of(node), node.value)
+
+    def items(self):
+        return self.range()
+
+    def keys(self):
+        for node in self.tree.iterNodes(None, None, False):
+            yield self.key_of(node)
+
+    __iter__ = keys
+
+    def avl_to_array(self):
+        # time complexity O(n)
+        if self.decode is None:
+            return self.tree.avl_to_array()
+        decode = self.decode
+        return [(decode(key), value) for key, value in self.tree.avl_to_array()]
+
+    def max_node(self):
+        return self.tree.max_node()
+
+    def size(self):
+        return self.tree.size()
+
+    def get_root(self):
+        return self.tree.get_root()
+
+
+"""
+Binary file format of AVLTree.dump, little endian:
+    header     magic b"AVLT", version u16, reserved u16, n u64
+    keys       n x i64, ascending
+    offsets    (n + 1) x u64, value i is blob[offsets[i]:offsets[i + 1]]
+    tags       n x u8, how value i is encoded (VALUE_NONE, VALUE_STR, VALUE_BYTES, VALUE_PICKLE)
+    blob       the encoded values
+"""
+
+TREE_FILE_MAGIC = b"AVLT"
+TREE_FILE_VERSION = 1
+TREE_FILE_HEADER = struct.Struct("<4sHHQ")
+VALUE_NONE, VALUE_STR, VALUE_BYTES, VALUE_PICKLE = range(4)
+
+
+def encodeValue(value):
+    # returns (tag, bytes) of one value
+    if value is None:
+        return VALUE_NONE, b""
+    if isinstance(value, str):
+        return VALUE_STR, value.encode("utf-8")
+    if isinstance(value, bytes):
+        return VALUE_BYTES, value
+    return VALUE_PICKLE, pickle.dumps(value)
+
+
+def decodeValue(tag, data):
+    # inverse of encodeValue
+    if tag == VALUE_NONE:
+        return None
+    if tag == VALUE_STR:
+        return str(data, "utf-8")
+    if tag == VALUE_BYTES:
+        return bytes(data)
+    return pickle.loads(data)
+
+
+def writeTreeFile(path, items, n):
+    # writes n (key, value) pairs given in ascending key order
+    # time complexity O(n)
+    keys = array("q")
+    offsets = array("Q", [0])
+    tags = array("B")
+    blob = []
+    total = 0
+    for key, value in items:
+        keys.append(key)
+        tag, data = encodeValue(value)
+        tags.append(tag)
+        blob.append(data)
+        total += len(data)
+        offsets.append(total)
+    if sys.byteorder == "big":
+        keys.byteswap()
+        offsets.byteswap()
+    with open(path, "wb") as f:
+        f.write(TREE_FILE_HEADER.pack(TREE_FILE_MAGIC, TREE_FILE_VERSION, 0, n))
+        keys.tofile(f)
+        offsets.tofile(f)
+        tags.tofile(f)
+        f.writelines(blob)
+
+
+class MappedNode(object):
+    """A read-only handle to item index of a MappedAVLTree, values are decoded on access."""
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def key(self):
+        return self.tree.keys[self.index]
+
+    @property
+    def value(self):
+        return self.tree.valueAt(self.index)
+
+    def is_real_node(self):
+        # time complexity O(1)
+        return True
+
+
+"""
+A class answering read queries straight from a file written by AVLTree.dump.
+the file is memory mapped and never copied into nodes: the tree is implicit, the root of the
+items [lo..hi] being item (lo + hi) // 2 exactly as in AVLTree.from_sorted, so search walks the
+same path (and reports the same e) as it would on AVLTree.load(path).
+"""
+
+
+class MappedAVLTree(object):
+    """
+    Constructor, maps the file at path. use close() (or a with block) to unmap it.
+    """
+
+    def __init__(self, path):
+        self.keys = self.offsets = None
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file cannot be mapped
+            self.file.close()
+            raise ValueError("%s is not an AVLTree file" % path)
+        magic, version, _, n = TREE_FILE_HEADER.unpack_from(self.map, 0)
+        if magic != TREE_FILE_MAGIC or version != TREE_FILE_VERSION:
+            self.close()
+            raise ValueError("%s is not an AVLTree file" % path)
+        if sys.byteorder == "big":  # rare, fall back to byte swapped copies
+            self.keys = array("q", self.map[16:16 + 8 * n])
+            self.offsets = array("Q", self.map[16 + 8 * n:24 + 16 * n])
+            self.keys.byteswap()
+            self.offsets.byteswap()
+        else:
+            view = memoryview(self.map)
+            self.keys = view[16:16 + 8 * n].cast("q")
+            self.offsets = view[16 + 8 * n:24 + 16 * n].cast("Q")
+        self.tagsStart = 24 + 16 * n
+        self.blobStart = self.tagsStart + n
+        self.n = n
+
+    def close(self):
+        # releases the views before unmapping, nodes must not be used afterwards
+        if isinstance(self.keys, memoryview):
+            self.keys.release()
+            self.offsets.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def valueAt(self, i):
+        # decodes value i from the mapped blob
+        # time complexity O(len of value)
+        start = self.blobStart + self.offsets[i]
+        end = self.blobStart + self.offsets[i + 1]
+        return decodeValue(self.map[self.tagsStart + i], self.map[start:end])
+
+    """searches for a node in the dictionary corresponding to the key (starting at the root)
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (MappedNode,int)
+    @returns: a tuple (x,e) as in AVLTree.search
+    """
+
+    def search(self, key):
+        # time complexity O(logn)
+        keys = self.keys
+        lo, hi = 0, self.n - 1
+        e = 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            midKey = keys[mid]
+            if midKey == key:
+                return (MappedNode(self, mid), e)
+            if midKey < key:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+            e += 1
+        return (None, e)
+
+    """searches for a node in the dictionary corresponding to the key, starting at the max
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (MappedNode,int)
+    @returns: a tuple (x,e) where e counts the probes made
+    """
+
+    def finger_search(self, key):
+        # galloping search back from the maximum, then binary search inside the last gap
+        # time complexity O(logd), d being the number of keys bigger than key
+        keys = self.keys
+        hi = self.n - 1
+        e = 1
+        step = 1
+        lo = hi
+        while lo >= 0 and keys[lo] > key:
+            hi = lo - 1
+            lo = self.n - 1 - step
+            step *= 2
+            e += 1
+        lo = max(lo, 0)
+        i = bisect_left(keys, key, lo, hi + 1)
+        e += (hi - lo + 1).bit_length()
+        if i <= hi and keys[i] == key:
+            return (MappedNode(self, i), e)
+        return (None, e)
+
+    """returns the node holding the k-th smallest key in the dictionary
+
+    @type k: int
+    @param k: a rank between 1 and self.size()
+    @rtype: MappedNode
+    @returns: the node of rank k, None if k is out of range
+    """
+
+    def select(self, k):
+        # time complexity O(1)
+        if k < 1 or k > self.n:
+            return None
+        return MappedNode(self, k - 1)
+
+    """iterates over the (key, value) pairs with keys in the half open range [lo, hi)
+
+    @rtype: iterator
+    @returns: same as AVLTree.range
+    """
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # time complexity O(logn) to reach the first pair, then O(1) per step
+        start = 0 if lo is None else bisect_left(self.keys, lo)
+        end = self.n if hi is None else bisect_left(self.keys, hi)
+        indices = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        for i in indices:
+            yield (self.keys[i], self.valueAt(i))
+
+    def items(self):
+        # time complexity O(n)
+        return self.range()
+
+    def __iter__(self):
+        # iterates over the keys in ascending order
+        return iter(self.keys)
+
+    def max_node(self):
+        # time complexity O(1)
+        return MappedNode(self, self.n - 1) if self.n else None
+
+    def size(self):
+        # time complexity O(1)
+        return self.n
+
+
+
+"""
+A read optimized dictionary with the AVLTree interface, keys kept in sorted blocks.
+a lookup is two bisects, one over the last key of every block and one inside a block, instead of
+a Python level step per tree level, and the keys of a block are contiguous in one list.
+"""
+
+
+class BlockNode(object):
+    """A handle to item index of block of a BlockedAVLTree, valid until the next change of the keys."""
+
+    __slots__ = ('tree', 'block', 'index')
+
+    def __init__(self, tree, block, index):
+        self.tree = tree
+        self.block = block
+        self.index = index
+
+    @property
+    def key(self):
+        return self.tree.keyBlocks[self.block][self.index]
+
+    @property
+    def value(self):
+        return self.tree.valueBlocks[self.block][self.index]
+
+    @value.setter
+    def value(self, value):
+        self.tree.valueBlocks[self.block][self.index] = value
+
+    def is_real_node(self):
+        # time complexity O(1)
+        return True
+
+
+class BlockedAVLTree(object):
+    """
+    Constructor, an empty dictionary. blocks hold between BLOCK_SIZE // 2 and 2 * BLOCK_SIZE keys
+    (the only block may hold fewer).
+    """
+
+    BLOCK_SIZE = 256
+
+    def __init__(self):
+        self.keyBlocks = []
+        self.valueBlocks = []
+        self.fences = []  # last key of every block, ascending
+        self.starts = None  # rank of the first key of every block, rebuilt after a change
+        self.n = 0
+
+    """builds the dictionary from (key, value) pairs
+
+    @type items: iterable
+    @pre: keys are distinct and appear in ascending order
+    @rtype: BlockedAVLTree
+    """
+
+    @classmethod
+    def from_sorted(cls, items):
+        # time complexity O(n)
+        tree = cls()
+        if not isinstance(items, list):
+            items = list(items)
+        size = cls.BLOCK_SIZE
+        for start in range(0, len(items), size):
+            chunk = items[start:start + size]
+            tree.keyBlocks.append([key for key, _ in chunk])
+            tree.valueBlocks.append([value for _, value in chunk])
+            tree.fences.append(chunk[-1][0])
+        tree.n = len(items)
+        return tree
+
+    """builds the dictionary from the items of an AVLTree
+
+    @type avl: AVLTree
+    @rtype: BlockedAVLTree
+    """
+
+    @classmethod
+    def from_tree(cls, avl):
+        # time complexity O(n), one InOrder walk of avl
+        keys, values = avl.to_arrays()
+        tree = cls()
+        size = cls.BLOCK_SIZE
+        for start in range(0, len(keys), size):
+            tree.keyBlocks.append(keys[start:start + size])
+            tree.valueBlocks.append(values[start:start + size])
+            tree.fences.append(keys[min(start + size, len(keys)) - 1])
+        tree.n = len(keys)
+        return tree
+
+    """searches for a node in the dictionary corresponding to the key
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (BlockNode,int)
+    @returns: a tuple (x,e) where x is the node of key (None if not found) and e counts
+    the key comparisons made
+    """
+
+    def search(self, key):
+        # time complexity O(logn), two C level bisects
+        fences = self.fences
+        b = bisect_left(fences, key)
+        e = len(fences).bit_length()
+        if b == len(fences):
+            return (None, e)
+        block = self.keyBlocks[b]
+        i = bisect_left(block, key)
+        e += len(block).bit_length()
+        if block[i] == key:  # i is in range since key <= fences[b] == block[-1]
+            return (BlockNode(self, b, i), e)
+        return (None, e)
+
+    """searches for a node in the dictionary corresponding to the key, starting at the max
+
+    @type key: int
+    @param key: a key to be searched
+    @rtype: (BlockNode,int)
+    @returns: a tuple (x,e) where e counts the key comparisons made
+    """
+
+    def finger_search(self, key):
+        # galloping back over the fences from the last block, then a bisect in the block
+        # time complexity O(logd), d being the number of keys bigger than key
+        fences = self.fences
+        last = len(fences) - 1
+        if last < 0 or fences[last] < key:
+            return (None, 1)
+        e = 1
+        step = 1
+        hi = last
+        lo = last - 1
+        while lo >= 0 and fences[lo] >= key:
+            hi = lo
+            lo = last - 2 * step
+            step *= 2
+            e += 1
+        lo = max(lo + 1, 0)
+        b = bisect_left(fences, key, lo, hi)
+        e += (hi - lo + 1).bit_length()
+        block = self.keyBlocks[b]
+        i = bisect_left(block, key)
+        e += len(block).bit_length()
+        if block[i] == key:
+            return (BlockNode(self, b, i), e)
+        return (None, e)
+
+    """inserts a new item into the dictionary
+
+    @type key: int
+    @pre: key currently does not appear in the dictionary
+    @rtype: BlockNode
+    @returns: the node of the new item
+    """
+
+    def insert(self, key, val):
+        # time complexity O(logn + BLOCK_SIZE), a block over 2 * BLOCK_SIZE keys is halved
+        fences = self.fences
+        self.n += 1
+        self.starts = None
+        if not fences:
+            self.keyBlocks.append([key])
+            self.valueBlocks.append([val])
+            fences.append(key)
+            return BlockNode(self, 0, 0)
+        b = min(bisect_left(fences, key), len(fences) - 1)
+        block = self.keyBlocks[b]
+        i = bisect_left(block, key)
+        block.insert(i, key)
+        self.valueBlocks[b].insert(i, val)
+        fences[b] = block[-1]
+        if len(block) > 2 * self.BLOCK_SIZE:
+            half = len(block) // 2
+            self.splitBlock(b, half)
+            if i >= half:
+                return BlockNode(self, b + 1, i - half)
+        return BlockNode(self, b, i)
+
+    def splitBlock(self, b, half):
+        # helper, moves the keys of block b from position half on into a new block b + 1
+        # time complexity O(BLOCK_SIZE + number of blocks)
+        keys, values = self.keyBlocks[b], self.valueBlocks[b]
+        self.keyBlocks.insert(b + 1, keys[half:])
+        self.valueBlocks.insert(b + 1, values[half:])
+        del keys[half:]
+        del values[half:]
+        self.fences[b] = keys[-1]
+        self.fences.insert(b + 1, self.keyBlocks[b + 1][-1])
+
+    """deletes node from the dictionary
+
+    @type node: BlockNode
+    @pre: node was returned by self after the last change of the keys
+    """
+
+    def delete(self, node):
+        # time complexity O(BLOCK_SIZE + number of blocks / BLOCK_SIZE) amortized
+        b, i = node.block, node.index
+        keys, values = self.keyBlocks[b], self.valueBlocks[b]
+        del keys[i]
+        del values[i]
+        self.n -= 1
+        self.starts = None
+        if not keys:
+            del self.keyBlocks[b]
+            del self.valueBlocks[b]
+            del self.fences[b]
+            return
+        self.fences[b] = keys[-1]
+        if len(keys) < self.BLOCK_SIZE // 2 and b + 1 < len(self.keyBlocks):  # merge with the next block
+            keys.extend(self.keyBlocks.pop(b + 1))
+            values.extend(self.valueBlocks.pop(b + 1))
+            del self.fences[b + 1]
+            self.fences[b] = keys[-1]
+            if len(keys) > 2 * self.BLOCK_SIZE:
+                self.splitBlock(b, len(keys) // 2)
+
+    def delete_key(self, key):
+        # returns True if key was found and deleted
+        # time complexity O(logn + BLOCK_SIZE)
+        node = self.search(key)[0]
+        if node is None:
+            return False
+        self.delete(node)
+        return True
+
+    def blockStarts(self):
+        # helper, rank - 1 of the first key of every block, cached until the next change
+        # time complexity O(number of blocks) after a change, O(1) otherwise
+        if self.starts is None:
+            starts = []
+            total = 0
+            for keys in self.keyBlocks:
+                starts.append(total)
+                total += len(keys)
+            self.starts = starts
+        return self.starts
+
+    """returns the node holding the k-th smallest key in the dictionary
+
+    @type k: int
+    @param k: a rank between 1 and self.size()
+    @rtype: BlockNode
+    @returns: the node of rank k, None if k is out of range
+    """
+
+    def select(self, k):
+        # time complexity O(logn)
+        if k < 1 or k > self.n:
+            return None
+        starts = self.blockStarts()
+        b = bisect_right(starts, k - 1) - 1
+        return BlockNode(self, b, k - 1 - starts[b])
+
+    def rank(self, key):
+        # number of keys <= key
+        # time complexity O(logn)
+        b = bisect_right(self.fences, key)
+        if b == len(self.fences):
+            return self.n
+        return self.blockStarts()[b] + bisect_right(self.keyBlocks[b], key)
+
+    """iterates over the (key, value) pairs with keys in the half open range [lo, hi)
+
+    @rtype: iterator
+    @returns: same as AVLTree.range
+    """
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # time complexity O(logn) to reach the first pair, then O(1) per step
+        fences = self.fences
+        first = 0 if lo is None else bisect_left(fences, lo)
+        last = len(fences) - 1 if hi is None else min(bisect_left(fences, hi), len(fences) - 1)
+        blocks = range(last, first - 1, -1) if reverse else range(first, last + 1)
+        for b in blocks:
+            keys, values = self.keyBlocks[b], self.valueBlocks[b]
+            start = 0 if lo is None else bisect_left(keys, lo)
+            end = len(keys) if hi is None else bisect_left(keys, hi)
+            indices = range(end - 1, start - 1, -1) if reverse else range(start, end)
+            for i in indices:
+                yield (keys[i], values[i])
+
+    def items(self):
+        # time complexity O(n)
+        return self.range()
+
+    def keys(self):
+        for keys in self.keyBlocks:
+            for key in keys:
+                yield key
+
+    __iter__ = keys
+
+    def avl_to_array(self):
+        # time complexity O(n)
+        res = []
+        for keys, values in zip(self.keyBlocks, self.valueBlocks):
+            res.extend(zip(keys, values))
+        return res
+
+    def max_node(self):
+        # time complexity O(1)
+        if not self.n:
+            return None
+        return BlockNode(self, len(self.keyBlocks) - 1, len(self.keyBlocks[-1]) - 1)
+
+    def size(self):
+        # time complexity O(1)
+        return self.n
+
+
+
+"""
+Write ahead log of DurableAVLTree, one file per checkpoint generation, little endian.
+every record is: body length u32, crc32 of body u32, body. a body is
+    op u8, key i64, tag u8, value length u32, value    (encoded as in the tree file format)
+and a WAL_JOIN body is followed, inside the same body, by count u64 and count x (key, tag, length, value)
+items of the joined tree. a record that is cut short or fails its crc ends the log.
+"""
+
+WAL_INSERT = 1
+WAL_FINGER_INSERT = 2
+WAL_DELETE = 3
+WAL_JOIN = 4
+WAL_SPLIT = 5
+WAL_RECORD_HEADER = struct.Struct("<II")
+WAL_ITEM = struct.Struct("<qBI")
+WAL_COUNT = struct.Struct("<Q")
+WAL_FILE_NAME = re.compile(r"(checkpoint|wal)-(\d+)(\.tmp)?")
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+def encodeWalItem(key, value):
+    # returns the bytes of one (key, value) item of a log record
+    tag, data = encodeValue(value)
+    return WAL_ITEM.pack(key, tag, len(data)) + data
+
+
+def decodeWalItem(body, offset):
+    # inverse of encodeWalItem, returns (key, value, offset after the item)
+    key, tag, length = WAL_ITEM.unpack_from(body, offset)
+    offset += WAL_ITEM.size
+    return key, decodeValue(tag, body[offset:offset + length]), offset + length
+
+
+def fsyncDirectory(directory):
+    # makes a rename inside directory durable, where the platform allows opening directories
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableAVLTree(object):
+    """
+    Constructor, opens (or creates) the durable dictionary kept in directory and recovers it from
+    the latest checkpoint and the log written after it.
+    fsync - "always": every change is written and fsynced before the call returns,
+            "batch": changes are written and fsynced together once group_size are pending,
+            "never": changes are written once group_size are pending and left to the OS to flush.
+    a change is durable once commit() (or a checkpoint, or close()) returned after it.
+    checkpoint_every - changes logged between two automatic checkpoints, None for manual only.
+    keys are ints and values None, str, bytes or picklable, as for AVLTree.dump.
+    """
+
+    def __init__(self, directory, fsync="batch", group_size=64, checkpoint_every=100000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("unknown fsync policy %r" % (fsync,))
+        self.directory = directory
+        self.fsync = fsync
+        self.group_size = 1 if fsync == "always" else group_size
+        self.checkpoint_every = checkpoint_every
+        self.pending = []  # encoded records not written yet
+        self.logged = 0  # changes logged since the last checkpoint
+        self.replayed = 0  # records replayed by the last recovery
+        os.makedirs(directory, exist_ok=True)
+        self.generation, self.tree = self.recover()
+        self.log = open(self.walPath(self.generation), "ab")
+
+    def checkpointPath(self, generation):
+        return os.path.join(self.directory, "checkpoint-%d" % generation)
+
+    def walPath(self, generation):
+        return os.path.join(self.directory, "wal-%d" % generation)
+
+    def recover(self):
+        # helper, returns (generation, tree) from the newest complete checkpoint and its log,
+        # cuts a torn log tail and removes older generations and unfinished checkpoints
+        # time complexity O(n + length of the log)
+        files = []  # (kind, generation, temporary, name) of the files this class writes
+        for name in os.listdir(self.directory):
+            match = WAL_FILE_NAME.fullmatch(name)
+            if match is not None:
+                files.append((match.group(1), int(match.group(2)), match.group(3) is not None, name))
+        generations = [number for kind, number, temporary, name in files
+                       if kind == "checkpoint" and not temporary]
+        generation = max(generations) if generations else 0
+        if generations:
+            tree = AVLTree.load(self.checkpointPath(generation))
+        else:
+            tree = AVLTree()
+        path = self.walPath(generation)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            tree, end = self.replay(tree, data)
+            if end < len(data):  # drop the torn tail so new records follow the last good one
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        for kind, number, temporary, name in files:  # other names in the directory are not ours
+            if temporary or number < generation:
+                os.remove(os.path.join(self.directory, name))
+        return generation, tree
+
+    def replay(self, tree, data):
+        # helper, applies the records of data to tree, returns (tree, offset after the last good record)
+        # time complexity O(length of data * logn)
+        offset = 0
+        self.replayed = 0
+        while offset + WAL_RECORD_HEADER.size <= len(data):
+            length, crc = WAL_RECORD_HEADER.unpack_from(data, offset)
+            start = offset + WAL_RECORD_HEADER.size
+            body = data[start:start + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                break
+            tree = self.apply(tree, body)
+            offset = start + length
+            self.replayed += 1
+        return tree, offset
+
+    @staticmethod
+    def apply(tree, body):
+        # helper, applies one record body to tree and returns the tree holding the result
+        op = body[0]
+        key, value, offset = decodeWalItem(body, 1)
+        if op == WAL_INSERT:
+            tree.insert(key, value)
+        elif op == WAL_FINGER_INSERT:
+            tree.finger_insert(key, value)
+        elif op == WAL_DELETE:
+            tree.delete_key(key)
+        elif op == WAL_JOIN:
+            count = WAL_COUNT.unpack_from(body, offset)[0]
+            offset += WAL_COUNT.size
+            items = []
+            for _ in range(count):
+                itemKey, itemValue, offset = decodeWalItem(body, offset)
+                items.append((itemKey, itemValue))
+            tree.join(AVLTree.from_sorted(items), key, value)
+        elif op == WAL_SPLIT:
+            tree = tree.split(tree.search(key)[0])[0]
+        return tree
+
+    def record(self, op, key, value, extra=b""):
+        # helper, queues one record and writes the group when it is full
+        body = bytes((op,)) + encodeWalItem(key, value) + extra
+        self.pending.append(WAL_RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body)
+        self.logged += 1
+        if len(self.pending) >= self.group_size:
+            self.writePending(self.fsync != "never")
+        if self.checkpoint_every is not None and self.logged >= self.checkpoint_every:
+            self.checkpoint()
+
+    def writePending(self, sync):
+        # helper, writes the queued records in one call and fsyncs them if sync
+        if self.pending:
+            self.log.write(b"".join(self.pending))
+            self.pending = []
+        self.log.flush()
+        if sync:
+            os.fsync(self.log.fileno())
+
+    """makes every change made so far durable
+
+    @rtype: None
+    """
+
+    def commit(self):
+        # time complexity O(pending records), one write and one fsync
+        self.writePending(True)
+
+    """writes the whole dictionary to a new checkpoint and starts a new empty log
+
+    @rtype: None
+    """
+
+    def checkpoint(self):
+        # the checkpoint is complete once renamed, recovery prefers it and ignores the older log
+        # time complexity O(n), one InOrder walk
+        self.writePending(True)
+        generation = self.generation + 1
+        temporary = self.checkpointPath(generation) + ".tmp"
+        self.tree.dump(temporary)
+        with open(temporary, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpointPath(generation))
+        fsyncDirectory(self.directory)
+        self.log.close()
+        self.log = open(self.walPath(generation), "ab")
+        for path in (self.checkpointPath(self.generation), self.walPath(self.generation)):
+            if os.path.exists(path):
+                os.remove(path)
+        self.generation = generation
+        self.logged = 0
+
+    def close(self):
+        self.commit()
+        self.log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def insert(self, key, val):
+        # returns (x, e, h) as AVLTree.insert
+        result = self.tree.insert(key, val)
+        self.record(WAL_INSERT, key, val)
+        return result
+
+    def finger_insert(self, key, val):
+        # returns (x, e, h) as AVLTree.finger_insert
+        result = self.tree.finger_insert(key, val)
+        self.record(WAL_FINGER_INSERT, key, val)
+        return result
+
+    def delete(self, node):
+        key = node.key
+        self.tree.delete(node)
+        self.record(WAL_DELETE, key, None)
+
+    def delete_key(self, key):
+        # returns True if key was found and deleted
+        if not self.tree.delete_key(key):
+            return False
+        self.record(WAL_DELETE, key, None)
+        return True
+
+    """joins tree2 and the item (key, val) into self, as AVLTree.join
+
+    @type tree2: AVLTree
+    @param tree2: a plain AVLTree whose items are logged, it must not be used afterwards
+    """
+
+    def join(self, tree2, key, val):
+        # time complexity O(logn) for the join, O(size of tree2) to log it
+        items = [encodeWalItem(itemKey, itemValue) for itemKey, itemValue in tree2.items()]
+        self.tree.join(tree2, key, val)
+        self.record(WAL_JOIN, key, val, WAL_COUNT.pack(len(items)) + b"".join(items))
+
+    """splits the dictionary at node, self keeps the keys smaller than node.key
+
+    @type node: AVLNode
+    @pre: node is in self
+    @rtype: AVLTree
+    @returns: a plain (not durable) AVLTree of the keys bigger than node.key
+    """
+
+    def split(self, node):
+        # time complexity O(logn)
+        key = node.key
+        self.tree, bigger = self.tree.split(node)
+        self.record(WAL_SPLIT, key, None)
+        return bigger
+
+    def search(self, key):
+        return self.tree.search(key)
+
+    def finger_search(self, key):
+        return self.tree.finger_search(key)
+
+    def items(self):
+        return self.tree.items()
+
+    def avl_to_array(self):
+        return self.tree.avl_to_array()
+
+    def max_node(self):
+        return self.tree.max_node()
+
+    def size(self):
+        return self.tree.size()
+
+    def get_root(self):
+        return self.tree.get_root()
+
+
+
+"""
+Lookup caches for AVLTree.enable_cache, mapping keys to nodes.
+"""
+
+
+class LRUNodeCache(object):
+    """Evicts the least recently used key."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        # time complexity O(1)
+        node = self.entries.get(key)
+        if node is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return node
+
+    def put(self, key, node):
+        # time complexity O(1)
+        self.entries[key] = node
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        # time complexity O(1)
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ClockNodeCache(object):
+    """Second chance (CLOCK) eviction, a hit only sets a reference bit instead of reordering."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = {}  # key -> slot
+        self.keys = [None] * capacity
+        self.nodes = [None] * capacity
+        self.referenced = bytearray(capacity)
+        self.hand = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        # time complexity O(1)
+        slot = self.slots.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.referenced[slot] = 1
+        self.hits += 1
+        return self.nodes[slot]
+
+    def put(self, key, node):
+        # time complexity O(1) amortized
+        slot = self.slots.get(key)
+        if slot is None:
+            referenced = self.referenced
+            while referenced[self.hand]:  # second chance for referenced slots
+                referenced[self.hand] = 0
+                self.hand = (self.hand + 1) % self.capacity
+            slot = self.hand
+            self.hand = (self.hand + 1) % self.capacity
+            if self.nodes[slot] is not None:
+                del self.slots[self.keys[slot]]
+                self.evictions += 1
+            self.keys[slot] = key
+            self.slots[key] = slot
+        self.nodes[slot] = node
+
+    def discard(self, key):
+        # time complexity O(1)
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.keys[slot] = self.nodes[slot] = None
+            self.referenced[slot] = 0
+
+    def clear(self):
+        self.slots.clear()
+        self.keys = [None] * self.capacity
+        self.nodes = [None] * self.capacity
+        self.referenced = bytearray(self.capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+
+"""
+Operation counters for AVLTree.enable_stats.
+"""
+
+
+class AVLStats(object):
+    """Counters collected by an AVLTree while its stats field is set.
+
+    histograms are dicts from a value to the number of times it was seen. promotes and rotations
+    are kept per operation: "insert", "delete" and "join" (the rebalancing after a join).
+    """
+
+    OPERATIONS = ("insert", "delete", "join")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # time complexity O(1)
+        self.searchPaths = {}  # e of search, finger_search and search_from
+        self.promotes = dict.fromkeys(self.OPERATIONS, 0)
+        self.singleRotations = dict.fromkeys(self.OPERATIONS, 0)
+        self.doubleRotations = dict.fromkeys(self.OPERATIONS, 0)
+        self.joinHeightDiffs = {}  # |height(self) - height(tree2)| of join
+        self.splitPieces = {}  # number of subtrees joined by one split
+
+    def recordSearch(self, e):
+        self.searchPaths[e] = self.searchPaths.get(e, 0) + 1
+
+    def recordRotation(self, operation, double):
+        if double:
+            self.doubleRotations[operation] += 1
+        else:
+            self.singleRotations[operation] += 1
+
+    def recordJoin(self, heightDiff):
+        self.joinHeightDiffs[heightDiff] = self.joinHeightDiffs.get(heightDiff, 0) + 1
+
+    def recordSplit(self, pieces):
+        self.splitPieces[pieces] = self.splitPieces.get(pieces, 0) + 1
+
+    """returns a copy of the counters for export
+
+    @type reset: bool
+    @param reset: also start the counters over if True
+    @rtype: dict
+    """
+
+    def snapshot(self, reset=False):
+        # time complexity O(size of the histograms)
+        result = {
+            "search_path_lengths": dict(self.searchPaths),
+            "promotes": dict(self.promotes),
+            "single_rotations": dict(self.singleRotations),
+            "double_rotations": dict(self.doubleRotations),
+            "join_height_diffs": dict(self.joinHeightDiffs),
+            "split_pieces": dict(self.splitPieces),
+        }
+        if reset:
+            self.reset()
+        return result
@@ -0,0 +1,835 @@
+"""Benchmarks for the AVL tree project.
+
+run: python benchmark.py <name> [size ...]
+     python benchmark.py suite [size ...] [--traces ...] [--json out.json] [--baseline base.json]
+"""
+import argparse
+import asyncio
+import bisect
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from AVLTree import (AVLTree, ArrayAVLTree, AsyncAVLTree, BlockedAVLTree, ConcurrentAVLTree, DurableAVLTree, IntervalAVLTree,
+                     KeyedAVLTree, MappedAVLTree, PersistentAVLTree)
+
+
+def timed(func, *args):
+    # returns (result, seconds) of a single call, with the cyclic gc off as timeit does
+    # (otherwise its passes over every live node of the trees dominate large runs)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def bench_from_sorted(sizes):
+    # bulk build from sorted/unsorted input against n repeated inserts
+    print("%10s %12s %12s %12s" % ("n", "insert", "from_sorted", "from_unsorted"))
+    for n in sizes:
+        items = [(k, str(k)) for k in range(n)]
+        shuffled = items[:]
+        random.shuffle(shuffled)
+
+        def repeatedInsert():
+            tree = AVLTree()
+            for key, value in shuffled:
+                tree.insert(key, value)
+            return tree
+
+        _, tInsert = timed(repeatedInsert)
+        _, tSorted = timed(AVLTree.from_sorted, items)
+        _, tUnsorted = timed(AVLTree.from_unsorted, shuffled)
+        print("%10d %11.3fs %11.3fs %11.3fs" % (n, tInsert, tSorted, tUnsorted))
+
+
+def bench_memory(sizes):
+    # bytes per key held by the tree structure (keys and values are shared by both engines)
+    print("%10s %14s %14s" % ("n", "AVLTree", "ArrayAVLTree"))
+    for n in sizes:
+        items = [(k, None) for k in range(n)]
+        perKey = []
+        for engine in (AVLTree, ArrayAVLTree):
+            tracemalloc.start()
+            tree = engine.from_sorted(items)
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            perKey.append(used / n)
+            del tree
+        print("%10d %13.1fB %13.1fB" % (n, perKey[0], perKey[1]))
+
+
+def bench_batch(sizes):
+    # insert_many/delete_many of a 1% batch against per-key finger_insert/delete
+    print("%10s %8s %12s %12s %12s %12s" % ("n", "m", "finger_ins", "insert_many", "delete", "delete_many"))
+    for n in sizes:
+        m = max(n // 100, 1)
+        base = [(k, None) for k in range(0, 2 * n, 2)]
+        batch = [(random.randrange(n) * 2 + 1, None) for _ in range(m)]
+        batch = list(dict(batch).items())
+        keys = [k for k, _ in batch]
+
+        single = AVLTree.from_sorted(base)
+
+        def perKey():
+            e = h = 0
+            for key, value in batch:
+                _, ei, hi = single.finger_insert(key, value)
+                e, h = e + ei, h + hi
+            return e, h
+
+        (e1, h1), tSingle = timed(perKey)
+        _, tDelete = timed(lambda: [single.delete(single.search(k)[0]) for k in keys])
+        bulk = AVLTree.from_sorted(base)
+        (_, e2, h2), tBulk = timed(bulk.insert_many, batch)
+        _, tDeleteBulk = timed(bulk.delete_many, keys)
+        print("%10d %8d %11.3fs %11.3fs %11.3fs %11.3fs   e %d -> %d, h %d -> %d"
+              % (n, len(batch), tSingle, tBulk, tDelete, tDeleteBulk, e1, e2, h1, h2))
+
+
+def bench_setops(sizes):
+    # union of a small tree into a large one against exporting both with avl_to_array
+    print("%10s %8s %12s %12s" % ("n", "m", "union", "array_merge"))
+    for n in sizes:
+        for m in (10, n // 100, n // 2):
+            base = [(k, None) for k in range(0, 2 * n, 2)]
+            small = sorted(set((random.randrange(2 * n), None) for _ in range(m)))
+
+            big, other = AVLTree.from_sorted(base), AVLTree.from_sorted(small)
+
+            def arrayMerge():
+                merged = dict(other.avl_to_array())
+                merged.update(big.avl_to_array())
+                return AVLTree.from_sorted(sorted(merged.items()))
+
+            _, tArray = timed(arrayMerge)
+            _, tUnion = timed(big.union, other)
+            print("%10d %8d %11.3fs %11.3fs" % (n, m, tUnion, tArray))
+
+
+def keepEven(key, value):
+    # module level so that it can be sent to worker processes
+    return key % 2 == 0
+
+
+def bench_parallel(sizes):
+    # parallel build, union and filter with 1 to os.cpu_count() workers
+    workerCounts = sorted(set([1, 2, 4, 8, os.cpu_count() or 1]))
+    print("%10s %8s %12s %12s %12s" % ("n", "workers", "build", "union", "filter"))
+    for n in sizes:
+        items = [(random.randrange(10 * n), None) for _ in range(n)]
+        items = list(dict(items).items())
+        for workers in workerCounts:
+            tree, tBuild = timed(AVLTree.parallel_from_unsorted, items, workers, 0)
+            otherKeys = set(random.randrange(10 * n) for _ in range(n // 2))
+            other = AVLTree.from_unsorted([(k, None) for k in otherKeys])
+            _, tUnion = timed(tree.parallel_union, other, None, workers, 0)
+            _, tFilter = timed(tree.parallel_filter, keepEven, workers, 0)
+            print("%10d %8d %11.3fs %11.3fs %11.3fs" % (n, workers, tBuild, tUnion, tFilter))
+
+
+def bench_persistent(sizes):
+    # snapshot cost, and insert throughput of one writer while N reader threads scan snapshots
+    for n in sizes:
+        tree = PersistentAVLTree()
+        for key in random.sample(range(4 * n), n):
+            tree.insert(key, None)
+        _, tSnapshot = timed(lambda: [tree.snapshot() for _ in range(1000)])
+        print("n=%d snapshot %.2fus" % (n, tSnapshot * 1000))
+        print("%10s %14s %14s" % ("readers", "inserts/s", "scanned/s"))
+        for readers in (0, 1, 2, 4, 8):
+            stop = threading.Event()
+            scanned = [0] * readers
+
+            def reader(index):
+                while not stop.is_set():
+                    for _ in tree.snapshot().items():
+                        scanned[index] += 1
+
+            threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+            for thread in threads:
+                thread.start()
+            writes = random.sample(range(4 * n, 8 * n), min(20000, 4 * n))
+            start = time.perf_counter()
+            for key in writes:
+                tree.insert(key, None)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for key in writes:
+                tree.delete(tree.search(key)[0])
+            print("%10d %14.0f %14.0f" % (readers, len(writes) / elapsed, sum(scanned) / elapsed))
+
+
+class GlobalLockTree(object):
+    # reference: every call under one lock
+    def __init__(self, tree):
+        self.tree = tree
+        self.lock = threading.Lock()
+
+    def search(self, key):
+        with self.lock:
+            return self.tree.search(key)
+
+    def insert(self, key, val):
+        with self.lock:
+            return self.tree.insert(key, val)
+
+
+def bench_concurrent(sizes):
+    # throughput of 90% search / 10% insert from N threads, ConcurrentAVLTree (with the default
+    # locking for this build, then forced to shared reads and batched writes) against one global lock
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("GIL %s" % ("enabled" if gil else "disabled (free-threaded build)"))
+    print("%10s %8s %14s %14s %14s %8s %8s" % ("n", "threads", "global lock", "concurrent", "shared reads",
+                                              "writes", "batches"))
+    opsPerThread = 20000
+    wrappers = (GlobalLockTree, ConcurrentAVLTree, lambda tree: ConcurrentAVLTree(tree, shared_reads=True))
+    for n in sizes:
+        for threads in (1, 2, 4, 8):
+            results = []
+            for wrapper in wrappers:
+                shared = wrapper(AVLTree.from_sorted([(k, None) for k in range(0, 2 * n, 2)]))
+                counter = iter(range(2 * n + 1, 10 ** 12, 2))  # distinct odd keys for the inserts
+
+                def work():
+                    for i in range(opsPerThread):
+                        if i % 10 == 0:
+                            shared.insert(next(counter), None)
+                        else:
+                            shared.search(random.randrange(2 * n))
+
+                pool = [threading.Thread(target=work) for _ in range(threads)]
+                start = time.perf_counter()
+                for thread in pool:
+                    thread.start()
+                for thread in pool:
+                    thread.join()
+                results.append(threads * opsPerThread / (time.perf_counter() - start))
+            print("%10d %8d %13.0f/s %13.0f/s %13.0f/s %8d %8d" % (n, threads, results[0], results[1], results[2],
+                                                             threads * opsPerThread // 10, shared.batches))
+
+
+def residentBytes():
+    # current resident set size on Linux, None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def bench_startup(sizes):
+    # cold start from a dump: rebuilding with insert, AVLTree.load and MappedAVLTree
+    print("%10s %-14s %10s %14s %14s" % ("n", "start", "time", "python heap", "rss growth"))
+    for n in sizes:
+        items = [(k, "v%d" % k) for k in random.sample(range(10 * n), n)]
+        path = os.path.join(tempfile.mkdtemp(), "tree.avl")
+        AVLTree.from_unsorted(items).dump(path)
+
+        def rebuild():
+            tree = AVLTree()
+            for key, value in items:
+                tree.insert(key, value)
+            return tree
+
+        for name, start in (("insert", rebuild), ("load", lambda: AVLTree.load(path)),
+                            ("mmap", lambda: MappedAVLTree(path))):
+            rss = residentBytes()
+            tree, elapsed = timed(start)
+            growth = residentBytes() - rss if rss is not None else float("nan")
+            if name == "mmap":
+                tree.close()
+            del tree
+            tracemalloc.start()  # second run, timing is not taken under tracemalloc
+            tree = start()
+            heap = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            if name == "mmap":
+                tree.close()
+            del tree
+            print("%10d %-14s %9.3fs %13.1fM %13.1fM" % (n, name, elapsed, heap / 2 ** 20, growth / 2 ** 20))
+        os.remove(path)
+
+
+def keyTrace(kind, n, count):
+    # query keys over a tree holding 0..n-1: "sequential", "clustered" (random walk) or "random"
+    if kind == "sequential":
+        start = random.randrange(n)
+        return [(start + i) % n for i in range(count)]
+    if kind == "clustered":
+        trace = []
+        key = random.randrange(n)
+        for _ in range(count):
+            key = min(max(key + random.randint(-50, 50), 0), n - 1)
+            trace.append(key)
+        return trace
+    return [random.randrange(n) for _ in range(count)]
+
+
+def bench_finger(sizes):
+    # search, finger_search (from max) and the sticky finger on three traces, time and mean e
+    print("%10s %-11s %18s %18s %18s" % ("n", "trace", "search", "finger_search", "sticky search"))
+    for n in sizes:
+        tree = AVLTree.from_sorted([(k, None) for k in range(n)])
+        for kind in ("sequential", "clustered", "random"):
+            trace = keyTrace(kind, n, 100000)
+            cells = []
+            for sticky, method in ((False, tree.search), (False, tree.finger_search), (True, tree.search)):
+                tree.sticky = sticky
+                tree.finger = None
+                start = time.perf_counter()
+                edges = 0
+                for key in trace:
+                    edges += method(key)[1]
+                elapsed = time.perf_counter() - start
+                cells.append("%6.0fns e=%5.1f" % (elapsed / len(trace) * 1e9, edges / len(trace)))
+            tree.sticky = False
+            print("%10d %-11s %18s %18s %18s" % ((n, kind) + tuple(cells)))
+
+
+def zipfTrace(n, count, s=1.1):
+    # keys 0..n-1 with Zipf(s) popularity, popular ranks shuffled over the key space
+    weights = [1.0 / (rank + 1) ** s for rank in range(n)]
+    keys = list(range(n))
+    random.shuffle(keys)
+    return random.choices(keys, weights, k=count)
+
+
+def bench_cache(sizes):
+    # per lookup latency on a Zipf trace without cache and with LRU / CLOCK caches of 1% of n
+    print("%10s %-14s %14s %14s %10s" % ("n", "cache", "search", "finger_search", "hit rate"))
+    for n in sizes:
+        tree = AVLTree.from_sorted([(k, None) for k in range(n)])
+        trace = zipfTrace(n, 200000)
+        for policy in (None, "lru", "clock"):
+            cells = []
+            for method in ("search", "finger_search"):
+                if policy is None:
+                    tree.disable_cache()
+                else:
+                    tree.enable_cache(max(n // 100, 1), policy)
+                lookup = getattr(tree, method)
+                _, elapsed = timed(lambda: [lookup(key) for key in trace])
+                cells.append(elapsed / len(trace) * 1e9)
+            stats = tree.cache_stats()
+            rate = stats["hits"] / float(stats["hits"] + stats["misses"]) if stats else 0.0
+            print("%10d %-14s %12.0fns %12.0fns %9.1f%%" % (n, policy or "none", cells[0], cells[1], 100 * rate))
+        tree.disable_cache()
+
+
+def bench_search_many(sizes):
+    # lookups per second of 10^6 queries (half of them missing): a search loop against
+    # search_many on random and sorted queries, and on a numpy array when numpy is installed
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    print("%10s %-22s %14s" % ("n", "method", "lookups/s"))
+    for n in sizes:
+        tree = AVLTree.from_sorted([(2 * k, k) for k in range(n)])
+        queries = [random.randrange(2 * n) for _ in range(10 ** 6)]
+        ordered = sorted(queries)
+        tree.search_many(queries[:1])  # flatten outside the timed runs
+        runs = [("search loop", lambda: [tree.search(key) for key in queries]),
+                ("search_many", lambda: tree.search_many(queries)),
+                ("search_many sorted", lambda: tree.search_many(ordered))]
+        if numpy is not None:
+            array = numpy.array(queries)
+            runs.append(("search_many numpy", lambda: tree.search_many(array)))
+        for name, run in runs:
+            _, elapsed = timed(run)
+            print("%10d %-22s %14.0f" % (n, name, len(queries) / elapsed))
+
+
+def bench_aggregate(sizes):
+    # sum of the values over random key ranges: aggregate against a range scan and against
+    # avl_to_array followed by slicing, and the cost of keeping the sums on random inserts
+    print("%10s %16s %16s %16s %14s %14s" % ("n", "aggregate", "range scan", "array slice",
+                                             "insert", "insert + sums"))
+    for n in sizes:
+        keys = random.sample(range(n), n)
+        tree = AVLTree()
+        _, plain = timed(lambda: [tree.insert(key, key) for key in keys])
+        tree = AVLTree()
+        tree.enable_aggregate(lambda a, b: a + b, 0)
+        _, summed = timed(lambda: [tree.insert(key, key) for key in keys])
+        bounds = [sorted(random.sample(range(n), 2)) for _ in range(100)]
+        _, fast = timed(lambda: [tree.aggregate(lo, hi) for lo, hi in bounds])
+        _, scan = timed(lambda: [sum(v for _, v in tree.range(lo, hi)) for lo, hi in bounds])
+
+        def arraySlice():
+            pairs = tree.avl_to_array()
+            ordered = [key for key, _ in pairs]
+            return [sum(v for _, v in pairs[bisect.bisect_left(ordered, lo):bisect.bisect_left(ordered, hi)])
+                    for lo, hi in bounds]
+
+        _, sliced = timed(arraySlice)
+        print("%10d %14.0fns %14.0fns %14.0fns %12.0fns %12.0fns" % (
+            n, fast / len(bounds) * 1e9, scan / len(bounds) * 1e9, sliced / len(bounds) * 1e9,
+            plain / n * 1e9, summed / n * 1e9))
+
+
+def bench_upsert(sizes):
+    # n writes over n / 2 distinct keys: search before every insert against the upsert and
+    # multimap modes, which find an existing key on the insert descent itself
+    print("%10s %-20s %12s" % ("n", "method", "per write"))
+    for n in sizes:
+        writes = [(random.randrange(n // 2 or 1), i) for i in range(n)]
+
+        def searchThenInsert():
+            tree = AVLTree()
+            for key, val in writes:
+                node = tree.search(key)[0]
+                if node is None:
+                    tree.insert(key, val)
+                else:
+                    node.value = val
+
+        def insertOnly(mode):
+            tree = AVLTree(mode=mode)
+            for key, val in writes:
+                tree.insert(key, val)
+
+        runs = [("search + insert", searchThenInsert)]
+        for mode in ("upsert", "multimap"):
+            runs.append((mode, lambda mode=mode: insertOnly(mode)))
+        for name, run in runs:
+            gc.collect()  # the tree of the previous run is not collected inside this one
+            _, elapsed = timed(run)
+            print("%10d %-20s %10.0fns" % (n, name, elapsed / n * 1e9))
+
+
+def bench_expire(sizes):
+    # a sliding window of n timestamps, every step inserts n / 100 new keys and expires the
+    # oldest n / 100: search + delete per key, delete_key per key, and one delete_range
+    print("%10s %-16s %12s" % ("n", "method", "per step"))
+    for n in sizes:
+        batch = max(n // 100, 1)
+
+        def expireKeys(tree, step):
+            for key in range(step * batch, (step + 1) * batch):
+                tree.delete(tree.search(key)[0])
+
+        methods = [("search + delete", expireKeys),
+                   ("delete_key", lambda tree, step: [tree.delete_key(key) for key in
+                                                     range(step * batch, (step + 1) * batch)]),
+                   ("delete_range", lambda tree, step: tree.delete_range(None, (step + 1) * batch))]
+        for name, expire in methods:
+            tree = AVLTree.from_sorted([(key, None) for key in range(n)])
+            elapsed = 0.0
+            for step in range(50):
+                for key in range(n + step * batch, n + (step + 1) * batch):
+                    tree.insert(key, None)
+                _, seconds = timed(expire, tree, step)
+                elapsed += seconds
+            print("%10d %-16s %10.0fus" % (n, name, elapsed / 50 * 1e6))
+
+
+def bench_keys(sizes):
+    # insert and search per key: a plain AVLTree of ints against KeyedAVLTree with typed keys,
+    # a key function and a comparator, all on the same random order
+    print("%10s %-22s %12s %12s" % ("n", "tree", "insert", "search"))
+    for n in sizes:
+        order = random.sample(range(n), n)
+        cases = [("AVLTree int", AVLTree, order),
+                 ("keytype=int", lambda: KeyedAVLTree(keytype=int), order),
+                 ("keytype=float", lambda: KeyedAVLTree(keytype=float), [float(k) for k in order]),
+                 ("keytype=bytes", lambda: KeyedAVLTree(keytype=bytes), [b"%012d" % k for k in order]),
+                 ("keytype=str", lambda: KeyedAVLTree(keytype=str), ["%012d" % k for k in order]),
+                 ("key=negate", lambda: KeyedAVLTree(key=lambda k: -k), order),
+                 ("cmp=reversed", lambda: KeyedAVLTree(cmp=lambda a, b: b - a), order)]
+        for name, make, keys in cases:
+            inserting = searching = float("inf")
+            for _ in range(3):  # best of three, the cases differ by less than the run to run noise
+                tree = make()
+                inserting = min(inserting, timed(lambda: [tree.insert(key, None) for key in keys])[1])
+                searching = min(searching, timed(lambda: [tree.search(key) for key in keys])[1])
+            print("%10d %-22s %10.0fns %10.0fns" % (n, name, inserting / n * 1e9, searching / n * 1e9))
+
+
+def bench_layout(sizes):
+    # random lookup latency of the pointer based AVLTree against BlockedAVLTree built from it
+    # with a few block sizes, use sizes well above the L2/L3 cache (10^6 keys and more)
+    print("%10s %-22s %12s %12s" % ("n", "tree", "search", "finger"))
+    for n in sizes:
+        tree = AVLTree()
+        for key in random.sample(range(n), n):  # scattered nodes, as after a real workload
+            tree.insert(key, key)
+        queries = [random.randrange(n) for _ in range(200000)]
+        engines = [("AVLTree", tree)]
+        for size in (64, 256, 1024):
+            BlockedAVLTree.BLOCK_SIZE = size
+            engines.append(("Blocked %d" % size, BlockedAVLTree.from_tree(tree)))
+        BlockedAVLTree.BLOCK_SIZE = 256
+        for name, engine in engines:
+            _, searching = timed(lambda: [engine.search(key) for key in queries])
+            _, fingering = timed(lambda: [engine.finger_search(key) for key in queries])
+            print("%10d %-22s %10.0fns %10.0fns" % (n, name, searching / len(queries) * 1e9,
+                                                    fingering / len(queries) * 1e9))
+
+
+def rebuildByInsert(keys):
+    # rebuilds a tree of keys one insert at a time, what a restart costs without a log
+    tree = AVLTree()
+    for key in keys:
+        tree.insert(key, None)
+    return tree
+
+
+def bench_wal(sizes):
+    # logged inserts per second under every fsync policy, then recovery of n keys from a
+    # checkpoint of the first half plus a log of the second half against rebuilding by insert
+    print("%10s %-28s %14s" % ("n", "case", "result"))
+    for n in sizes:
+        keys = random.sample(range(n), n)
+        for policy in ("always", "batch", "never"):
+            count = min(n, 2000) if policy == "always" else n  # one fsync per insert is slow
+            with tempfile.TemporaryDirectory() as directory:
+                tree = DurableAVLTree(directory, fsync=policy, checkpoint_every=None)
+
+                def write():
+                    for key in keys[:count]:
+                        tree.insert(key, None)
+                    tree.commit()
+
+                _, elapsed = timed(write)
+                tree.close()
+            print("%10d %-28s %12.0f/s" % (n, "insert fsync=" + policy, count / elapsed))
+        with tempfile.TemporaryDirectory() as directory:
+            tree = DurableAVLTree(directory, checkpoint_every=None)
+            for key in keys[:n // 2]:
+                tree.insert(key, None)
+            tree.checkpoint()
+            for key in keys[n // 2:]:
+                tree.insert(key, None)
+            tree.close()
+            _, recovering = timed(DurableAVLTree, directory)
+        _, rebuilding = timed(rebuildByInsert, keys)
+        print("%10d %-28s %12.3fs" % (n, "recover checkpoint + log", recovering))
+        print("%10d %-28s %12.3fs" % (n, "rebuild by insert", rebuilding))
+
+
+class ClassicInsertTree(AVLTree):
+    # inserts through insertHelper and rotationsCheck, the path insert took before insertTopDown
+
+    def insert(self, key, val):
+        if not self.root.is_real_node():
+            return AVLTree.insert(self, key, val)
+        node = self.createNode(key, val)
+        self.Treesize += 1
+        return self.insertHelper(self.root, node, 2)
+
+
+def bench_insert(sizes):
+    # inserts per second of n sorted and n random keys, classic bottom-up rebalancing
+    # (insertHelper + rotationsCheck) against the top-down insert
+    print("%10s %-8s %14s %14s %8s" % ("n", "keys", "classic", "top-down", "speedup"))
+    for n in sizes:
+        for name, keys in (("sorted", list(range(n))), ("random", random.sample(range(n), n))):
+            rates = []
+            for cls in (ClassicInsertTree, AVLTree):
+                tree = cls()
+                _, elapsed = timed(lambda: [tree.insert(key, None) for key in keys])
+                rates.append(n / elapsed)
+            print("%10d %-8s %12.0f/s %12.0f/s %7.2fx" % (n, name, rates[0], rates[1], rates[1] / rates[0]))
+
+
+def bench_intervals(sizes):
+    # n intervals of random length up to 1000 over [0, 100n): overlap and stab queries on an
+    # IntervalAVLTree against a linear scan of avl_to_array, as done without the tree
+    print("%10s %-12s %14s %14s %10s" % ("n", "query", "tree", "scan", "matches"))
+    for n in sizes:
+        starts = sorted(random.sample(range(100 * n), n))
+        tree = IntervalAVLTree.from_sorted([((start, start + random.randrange(1, 1000)), None)
+                                            for start in starts])
+        windows = []
+        for _ in range(20):
+            lo = random.randrange(100 * n)
+            windows.append((lo, lo + 5000))
+        for name, query, test in (
+                ("overlapping", lambda lo, hi: list(tree.overlapping(lo, hi)),
+                 lambda key, lo, hi: key[0] < hi and key[1] > lo),
+                ("stab", lambda lo, hi: list(tree.stab(lo)), lambda key, lo, hi: key[0] <= lo < key[1])):
+            found, fast = timed(lambda: [query(lo, hi) for lo, hi in windows])
+            _, scan = timed(lambda: [[item for item in tree.avl_to_array() if test(item[0], lo, hi)]
+                                     for lo, hi in windows])
+            print("%10d %-12s %12.0fus %12.0fus %10.1f" % (n, name, fast / len(windows) * 1e6,
+                                                          scan / len(windows) * 1e6,
+                                                          sum(map(len, found)) / float(len(windows))))
+
+
+def bench_async(sizes):
+    # event loop stalls while avl_to_array of n keys runs next to a stream of point lookups:
+    # called directly on the tree, chunked by AsyncAVLTree, and in the default executor
+    print("%10s %-10s %12s %14s %14s" % ("n", "scan", "scan time", "max stall", "p99 lookup"))
+    for n in sizes:
+        tree = AVLTree.from_sorted([(key, None) for key in range(n)])
+        for name in ("blocking", "chunked", "executor"):
+            facade = AsyncAVLTree(tree, executor="default" if name == "executor" else None)
+            stalls, lookups = asyncio.run(asyncStallRun(facade, name == "blocking", n))
+            lookups.sort()
+            print("%10d %-10s %10.3fs %12.1fms %12.1fms" % (
+                n, name, stalls[0], max(stalls[1:]) * 1e3, lookups[int(len(lookups) * 0.99)] * 1e3))
+
+
+async def asyncStallRun(facade, blocking, n):
+    # returns ([scan seconds, loop turn gaps ...], lookup latencies) of one scan
+    gaps = [0.0]
+    latencies = []
+    done = []
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0)
+            gaps.append(time.perf_counter() - start)
+
+    async def lookups():
+        while not done:
+            start = time.perf_counter()
+            await facade.search(random.randrange(n))
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.0005)
+
+    async def scan():
+        await asyncio.sleep(0.01)  # let the others start
+        start = time.perf_counter()
+        if blocking:
+            facade.tree.avl_to_array()
+        else:
+            await facade.avl_to_array()
+        gaps[0] = time.perf_counter() - start
+        done.append(True)
+
+    await asyncio.gather(ticker(), lookups(), scan())
+    return gaps, latencies
+
+
+SUITE_TRACES = ("sorted", "reverse", "random", "clustered", "zipf")
+SUITE_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+LATENCY_SAMPLES = 100000  # latencies kept per measurement, every op is timed below this
+
+
+def suiteKeys(trace, n):
+    # (insertion order, query order) of the keys 0..n-1 for one trace
+    keys = list(range(n))
+    if trace == "reverse":
+        keys.reverse()
+    elif trace in ("random", "zipf"):
+        random.shuffle(keys)
+    elif trace == "clustered":  # runs of 64 consecutive keys, runs in random order
+        runs = [keys[i:i + 64] for i in range(0, n, 64)]
+        random.shuffle(runs)
+        keys = [key for run in runs for key in run]
+    queries = zipfTrace(n, min(n, 10 ** 6)) if trace == "zipf" else keys[:10 ** 6]
+    return keys, queries
+
+
+def measure(op, args):
+    # calls op(arg) for every arg, timing a sample of the calls one by one
+    # returns (total seconds, sorted sampled latencies in ns)
+    step = max(len(args) // LATENCY_SAMPLES, 1)
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for i, arg in enumerate(args):
+        if i % step:
+            op(arg)
+        else:
+            t0 = clock()
+            op(arg)
+            latencies.append(clock() - t0)
+    total = (clock() - start) / 1e9
+    latencies.sort()
+    return total, latencies
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0
+    return sortedValues[min(int(len(sortedValues) * fraction), len(sortedValues) - 1)]
+
+
+def suiteRecord(engine, op, trace, n, count, seconds, latencies, peak=None):
+    return {"engine": engine, "op": op, "trace": trace, "n": n, "ops": count,
+            "seconds": seconds, "throughput": count / seconds if seconds else 0.0,
+            "p50_ns": percentile(latencies, 0.5), "p99_ns": percentile(latencies, 0.99),
+            "peak_bytes": peak}
+
+
+def suiteAVLTree(trace, n, keys, queries, memory):
+    # every public AVLTree operation on one trace, returns records
+    records = []
+    for op in ("insert", "finger_insert"):
+        tree = AVLTree()
+        method = getattr(tree, op)
+        seconds, latencies = measure(lambda key: method(key, None), keys)
+        records.append(suiteRecord("AVLTree", op, trace, n, n, seconds, latencies))
+    for op in ("search", "finger_search"):
+        seconds, latencies = measure(getattr(tree, op), queries)
+        records.append(suiteRecord("AVLTree", op, trace, n, len(queries), seconds, latencies))
+    seconds, latencies = measure(lambda _: tree.avl_to_array(), range(3))
+    records.append(suiteRecord("AVLTree", "avl_to_array", trace, n, 3, seconds, latencies))
+    seconds, latencies = measure(lambda _: tree.to_arrays(), range(3))
+    records.append(suiteRecord("AVLTree", "to_arrays", trace, n, 3, seconds, latencies))
+
+    pivots = [tree.select(random.randrange(1, n + 1)).key for _ in range(min(n, 1000))]
+    holder = [tree]
+    splitSeconds, splitLatencies, joinLatencies = 0.0, [], []
+    for key in pivots:  # split at a key and join the two halves back, timed separately
+        node = holder[0].search(key)[0]
+        t0 = time.perf_counter_ns()
+        smaller, bigger = holder[0].split(node)
+        t1 = time.perf_counter_ns()
+        smaller.join(bigger, key, None)
+        t2 = time.perf_counter_ns()
+        holder[0] = smaller
+        splitLatencies.append(t1 - t0)
+        joinLatencies.append(t2 - t1)
+    for op, latencies in (("split", splitLatencies), ("join", joinLatencies)):
+        latencies.sort()
+        records.append(suiteRecord("AVLTree", op, trace, n, len(latencies), sum(latencies) / 1e9, latencies))
+
+    tree = holder[0]
+    nodes = [tree.search(key)[0] for key in keys]
+    seconds, latencies = measure(tree.delete, nodes)
+    records.append(suiteRecord("AVLTree", "delete", trace, n, n, seconds, latencies))
+
+    if memory:  # separate run, tracemalloc slows every allocation down
+        tracemalloc.start()
+        tree = AVLTree()
+        for key in keys:
+            tree.insert(key, None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        records[0]["peak_bytes"] = peak
+    return records
+
+
+def suiteReferences(trace, n, keys, queries):
+    # bisect on a sorted list and dict + sort, for insert, search, delete and avl_to_array
+    records = []
+    sortedList = []
+    seconds, latencies = measure(lambda key: bisect.insort(sortedList, key), keys)
+    records.append(suiteRecord("bisect_list", "insert", trace, n, n, seconds, latencies))
+
+    def listSearch(key):
+        i = bisect.bisect_left(sortedList, key)
+        return i < len(sortedList) and sortedList[i] == key
+
+    seconds, latencies = measure(listSearch, queries)
+    records.append(suiteRecord("bisect_list", "search", trace, n, len(queries), seconds, latencies))
+    seconds, latencies = measure(lambda key: sortedList.pop(bisect.bisect_left(sortedList, key)), keys)
+    records.append(suiteRecord("bisect_list", "delete", trace, n, n, seconds, latencies))
+
+    table = {}
+    seconds, latencies = measure(lambda key: table.__setitem__(key, None), keys)
+    records.append(suiteRecord("dict_sort", "insert", trace, n, n, seconds, latencies))
+    seconds, latencies = measure(table.get, queries)
+    records.append(suiteRecord("dict_sort", "search", trace, n, len(queries), seconds, latencies))
+    seconds, latencies = measure(lambda _: sorted(table.items()), range(3))
+    records.append(suiteRecord("dict_sort", "avl_to_array", trace, n, 3, seconds, latencies))
+    seconds, latencies = measure(table.__delitem__, keys)
+    records.append(suiteRecord("dict_sort", "delete", trace, n, n, seconds, latencies))
+    return records
+
+
+def compareBaseline(records, path, threshold):
+    # prints the throughput ratio against a saved run, returns the regressed records
+    with open(path) as f:
+        baseline = dict(((r["engine"], r["op"], r["trace"], r["n"]), r) for r in json.load(f))
+    regressions = []
+    print("\n%-12s %-14s %-10s %9s %9s" % ("engine", "op", "trace", "n", "ratio"))
+    for record in records:
+        old = baseline.get((record["engine"], record["op"], record["trace"], record["n"]))
+        if old is None or not old["throughput"]:
+            continue
+        ratio = record["throughput"] / old["throughput"]
+        flag = ""
+        if ratio < 1 - threshold:
+            regressions.append(record)
+            flag = "  REGRESSION"
+        print("%-12s %-14s %-10s %9d %8.2fx%s" % (record["engine"], record["op"], record["trace"],
+                                                   record["n"], ratio, flag))
+    return regressions
+
+
+def bench_suite(sizes, options):
+    # every public operation x sizes x key traces, see --help
+    records = []
+    print("%-12s %-14s %-10s %9s %14s %10s %10s %10s" % ("engine", "op", "trace", "n", "ops/s",
+                                                        "p50", "p99", "peak"))
+    for n in sizes:
+        for trace in options.traces:
+            keys, queries = suiteKeys(trace, n)
+            found = suiteAVLTree(trace, n, keys, queries, options.memory)
+            if n <= options.reference_max:
+                found += suiteReferences(trace, n, keys, queries)
+            for r in found:
+                peak = "%.1fM" % (r["peak_bytes"] / 2 ** 20) if r["peak_bytes"] else "-"
+                print("%-12s %-14s %-10s %9d %14.0f %8.0fns %8.0fns %10s" % (
+                    r["engine"], r["op"], r["trace"], n, r["throughput"], r["p50_ns"], r["p99_ns"], peak))
+            records += found
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(records, f, indent=1)
+    if options.baseline and compareBaseline(records, options.baseline, options.threshold):
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "async": bench_async,
+    "intervals": bench_intervals,
+    "insert": bench_insert,
+    "wal": bench_wal,
+    "layout": bench_layout,
+    "keys": bench_keys,
+    "expire": bench_expire,
+    "upsert": bench_upsert,
+    "aggregate": bench_aggregate,
+    "search_many": bench_search_many,
+    "cache": bench_cache,
+    "finger": bench_finger,
+    "startup": bench_startup,
+    "concurrent": bench_concurrent,
+    "persistent": bench_persistent,
+    "parallel": bench_parallel,
+    "setops": bench_setops,
+    "batch": bench_batch,
+    "from_sorted": bench_from_sorted,
+    "memory": bench_memory,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AVL tree benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS) + ["suite"])
+    parser.add_argument("sizes", nargs="*", type=lambda size: int(float(size)))
+    parser.add_argument("--traces", nargs="+", choices=SUITE_TRACES, default=list(SUITE_TRACES),
+                        help="suite: key traces to run")
+    parser.add_argument("--json", help="suite: write the results to this file")
+    parser.add_argument("--baseline", help="suite: compare with the results saved in this file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="suite: throughput loss counted as a regression (default 0.1)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="suite: skip the tracemalloc peak memory run")
+    parser.add_argument("--reference-max", type=int, default=10 ** 5,
+                        help="suite: largest n for the bisect/dict references (insort is quadratic)")
+    args = parser.parse_args()
+    if args.name == "suite":
+        bench_suite(args.sizes or SUITE_SIZES, args)
+    else:
+        BENCHMARKS[args.name](args.sizes or [10 ** 5, 10 ** 6])
@@ -0,0 +1,536 @@
+import asyncio
+import operator
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from AVLTree import (ArrayAVLTree, AsyncAVLTree, AVLTree, BlockedAVLTree, ConcurrentAVLTree, DurableAVLTree,
+                     IntervalAVLTree, KeyedAVLTree, MappedAVLTree, PersistentAVLTree)
+
+
+class OrderStatisticsTest(unittest.TestCase):
+    def test_select_rank_count_range(self):
+        rng = random.Random(3)
+        tree = AVLTree()
+        keys = rng.sample(range(0, 3000, 3), 500)
+        for key in keys:
+            tree.insert(key, key)
+        for key in keys[:200]:
+            tree.delete(tree.search(key)[0])
+        ordered = sorted(keys[200:])
+        for k, key in enumerate(ordered, 1):
+            self.assertEqual(tree.select(k).key, key)
+            self.assertEqual(tree.rank(key), k)
+        self.assertIsNone(tree.select(0))
+        self.assertIsNone(tree.select(len(ordered) + 1))
+        for _ in range(200):
+            lo, hi = sorted(rng.sample(range(-10, 3010), 2))
+            self.assertEqual(tree.count_range(lo, hi), len([key for key in ordered if lo <= key < hi]))
+            self.assertEqual(tree.rank(lo), len([key for key in ordered if key <= lo]))
+        self.assertEqual(tree.count_range(None, None), len(ordered))
+
+
+class SetOperationsTest(unittest.TestCase):
+    def test_against_dicts(self):
+        rng = random.Random(6)
+        operations = (
+            ("union", lambda a, b: dict(b, **a)),
+            ("intersection", lambda a, b: {key: a[key] for key in a if key in b}),
+            ("difference", lambda a, b: {key: a[key] for key in a if key not in b}),
+            ("symmetric_difference", lambda a, b: dict([(key, a[key]) for key in a if key not in b] +
+                                                       [(key, b[key]) for key in b if key not in a])),
+        )
+        for trial in range(40):
+            mine = {str(key): "a" for key in rng.sample(range(500), rng.randrange(0, 300))}
+            theirs = {str(key): "b" for key in rng.sample(range(500), rng.randrange(0, 300))}
+            for name, reference in operations:
+                tree = AVLTree.from_unsorted(mine.items())
+                other = AVLTree.from_unsorted(theirs.items())
+                self.assertIs(getattr(tree, name)(other), tree)
+                tree.validate()
+                self.assertEqual(tree.avl_to_array(), sorted(reference(mine, theirs).items()))
+                self.assertEqual(other.size(), 0)
+
+    def test_merge(self):
+        tree = AVLTree.from_sorted([(key, 1) for key in range(10)])
+        tree.union(AVLTree.from_sorted([(key, 10) for key in range(5, 15)]), lambda mine, theirs: mine + theirs)
+        self.assertEqual([value for key, value in tree.avl_to_array()], [1] * 5 + [11] * 5 + [10] * 5)
+
+
+class FingerTest(unittest.TestCase):
+    def test_finger_and_sticky_searches(self):
+        rng = random.Random(11)
+        keys = rng.sample(range(0, 20000, 2), 4000)
+        plain = AVLTree()
+        sticky = AVLTree(sticky=True)
+        for key in keys:
+            plain.insert(key, key)
+            sticky.insert(key, key)
+        ordered = sorted(keys)
+        for query in rng.sample(range(20000), 500) + ordered[:100]:
+            node = plain.search(query)[0]
+            self.assertIs(plain.finger_search(query)[0], node)
+            self.assertEqual(sticky.search(query)[0] is None, node is None)
+            if node is not None:
+                self.assertEqual(sticky.search(query)[0].key, query)
+        fromRoot = near = stickyNear = 0
+        node = plain.search(ordered[0])[0]
+        for key in ordered[1:1000]:  # a scan in key order walks O(1) amortized edges per key
+            fromRoot += plain.search(key)[1]
+            node, e = plain.search_from(node, key)
+            self.assertEqual(node.key, key)
+            near += e
+            stickyNear += sticky.search(key)[1]
+        self.assertLess(near * 2, fromRoot)
+        self.assertLess(stickyNear * 2, fromRoot)
+
+    def test_insert_near(self):
+        tree = AVLTree()
+        node = tree.insert(0, 0)[0]
+        for key in range(1, 2000):
+            node = tree.insert_near(node, key, key)[0]
+        tree.validate()
+        self.assertEqual([key for key, value in tree.avl_to_array()], list(range(2000)))
+
+
+class DeleteTest(unittest.TestCase):
+    def test_random_deletes_keep_the_tree_valid(self):
+        rng = random.Random(7)
+        tree = AVLTree()
+        keys = rng.sample(range(10000), 2000)
+        for key in keys:
+            tree.insert(key, key)
+        rng.shuffle(keys)
+        for i, key in enumerate(keys):
+            tree.delete(tree.search(key)[0])
+            if i % 50 == 0:
+                tree.validate()
+        self.assertEqual(tree.size(), 0)
+
+
+class ArrayAVLTreeTest(unittest.TestCase):
+    def test_split_node_stays_readable(self):
+        for tree in (AVLTree.from_sorted([(key, str(key)) for key in range(100)]),
+                     ArrayAVLTree.from_sorted([(key, str(key)) for key in range(100)])):
+            node = tree.search(40)[0]
+            smaller, bigger = tree.split(node)
+            self.assertEqual((node.key, node.value), (40, "40"))
+            self.assertEqual([key for key, value in smaller.avl_to_array()], list(range(40)))
+            self.assertEqual([key for key, value in bigger.avl_to_array()], list(range(41, 100)))
+
+
+class MultimapTest(unittest.TestCase):
+    def build(self, keys):
+        tree = AVLTree(mode="multimap")
+        expected = {}
+        for key in keys:
+            tree.insert(key, "a%d" % key)
+            tree.insert(key, "b%d" % key)
+            expected[key] = ["a%d" % key, "b%d" % key]
+        return tree, expected
+
+    def test_delete_range_keeps_value_lists(self):
+        for seed in range(50):
+            rng = random.Random(seed)
+            tree, expected = self.build(rng.sample(range(1000), 200))
+            lo, hi = sorted(rng.sample(range(1000), 2))
+            tree.delete_range(lo, hi)
+            tree.validate()
+            self.assertEqual(tree.avl_to_array(), sorted((k, v) for k, v in expected.items() if not lo <= k < hi))
+
+    def test_join_stores_a_value_list(self):
+        tree, expected = self.build(range(3))
+        bigger, more = self.build(range(10, 13))
+        tree.join(bigger, 5, "m")
+        tree.insert(5, "n")
+        tree.validate()
+        expected.update(more)
+        expected[5] = ["m", "n"]
+        self.assertEqual(tree.avl_to_array(), sorted(expected.items()))
+
+    def test_split_and_union_keep_value_lists(self):
+        tree, expected = self.build(range(0, 200, 2))
+        smaller, node, bigger = tree.splitKey(101)
+        self.assertIsNone(node)
+        self.assertEqual(smaller.avl_to_array() + bigger.avl_to_array(), sorted(expected.items()))
+        other, more = self.build(range(1, 200, 3))
+        union = self.build(range(0, 200, 2))[0]
+        union.union(other)
+        union.validate()
+        for key, values in more.items():
+            expected.setdefault(key, values)  # the value in self is kept
+        self.assertEqual(union.avl_to_array(), sorted(expected.items()))
+
+
+class AsyncAVLTreeTest(unittest.TestCase):
+    def test_scan_goes_on_through_writes(self):
+        async def scan(tree):
+            return [key async for key, value in tree]
+
+        async def write(tree):
+            for key in range(1, 2000, 2):
+                await tree.insert(key, str(key))
+                await tree.delete_key(key - 1)
+                await asyncio.sleep(0)
+
+        async def main():
+            tree = AsyncAVLTree(chunk=16)
+            await tree.insert_many([(key, str(key)) for key in range(0, 2000, 2)])
+            keys, _ = await asyncio.gather(scan(tree), write(tree))
+            self.assertEqual(keys, sorted(keys))
+            self.assertEqual(len(keys), len(set(keys)))
+            self.assertEqual([key async for key, value in tree], list(range(1, 2000, 2)))
+
+        asyncio.run(main())
+
+
+class HandleTest(unittest.TestCase):
+    # node handles from search and insert stay valid through the split based paths
+
+    def build(self, seed):
+        rng = random.Random(seed)
+        keys = rng.sample(range(0, 10000, 2), 2000)
+        tree = AVLTree()
+        handles = {key: tree.insert(key, key)[0] for key in keys}
+        return rng, tree, handles
+
+    def deleteThroughHandles(self, tree, handles, keys):
+        for key in keys:
+            self.assertIs(tree.search(key)[0], handles[key])
+            tree.delete(handles[key])
+        tree.validate()
+
+    def test_large_insert_many(self):
+        for seed in range(10):
+            rng, tree, handles = self.build(seed)
+            tree.insert_many([(key, key) for key in range(1, 10000, 4)])
+            kept = rng.sample(sorted(handles), 200)
+            self.deleteThroughHandles(tree, handles, kept)
+            self.assertEqual(tree.size(), 2000 + 2500 - 200)
+
+    def test_large_delete_many(self):
+        for seed in range(10):
+            rng, tree, handles = self.build(seed)
+            keys = sorted(handles)
+            tree.delete_many(keys[::2])
+            self.deleteThroughHandles(tree, handles, rng.sample(keys[1::2], 200))
+            self.assertEqual(tree.size(), 1000 - 200)
+
+    def test_delete_range(self):
+        for seed in range(10):
+            rng, tree, handles = self.build(seed)
+            keys = sorted(handles)
+            lo, hi = keys[500], keys[1500]
+            tree.delete_range(lo, hi)
+            outside = [key for key in keys if not lo <= key < hi]
+            self.deleteThroughHandles(tree, handles, rng.sample(outside, 200))
+            self.assertEqual(tree.size(), 1000 - 200)
+
+
+class BatchTest(unittest.TestCase):
+    def test_large_batches_in_every_mode(self):
+        rng = random.Random(1)
+        for mode in AVLTree.MODES:
+            tree = AVLTree(mode=mode)
+            expected = {}
+            for key in rng.sample(range(1000), 100):
+                tree.insert(key, key)
+                expected[key] = [key] if mode == "multimap" else key
+            batch = [(key, -key) for key in rng.sample(range(1000), 400) if mode is not None or key not in expected]
+            tree.insert_many(batch)
+            for key, value in batch:
+                if mode == "multimap":
+                    expected.setdefault(key, []).append(value)
+                else:
+                    expected[key] = value
+            tree.validate()
+            self.assertEqual(tree.avl_to_array(), sorted(expected.items()))
+            keys = rng.sample(range(1000), 300)
+            removed, _, _ = tree.delete_many(keys + keys[:10])
+            self.assertEqual(removed, len(set(keys) & set(expected)))
+            tree.validate()
+            self.assertEqual(tree.avl_to_array(), sorted(item for item in expected.items() if item[0] not in keys))
+
+
+class SearchManyTest(unittest.TestCase):
+    def test_matches_search(self):
+        rng = random.Random(16)
+        tree = AVLTree()
+        for key in rng.sample(range(0, 4000, 2), 1000):
+            tree.insert(key, str(key))
+        for queries in (rng.sample(range(-5, 4005), 500), sorted(rng.sample(range(-5, 4005), 500)), []):
+            found, values, edges = tree.search_many(queries, edges=True)
+            for query, hit, value, e in zip(queries, found, values, edges):
+                node, searchEdges = tree.search(query)
+                self.assertEqual(hit, node is not None)
+                self.assertEqual(value, None if node is None else node.value)
+                self.assertEqual(e, searchEdges)
+        self.assertEqual(tree.search_many([3]), ([False], [None]))
+        tree.insert(3, "3")  # the flattened keys are rebuilt after a change
+        self.assertEqual(tree.search_many([3]), ([True], ["3"]))
+        tree.delete(tree.search(3)[0])
+        self.assertEqual(tree.search_many([3]), ([False], [None]))
+
+
+class StatsTest(unittest.TestCase):
+    def test_counters(self):
+        tree = AVLTree()
+        stats = tree.enable_stats()
+        promotes = 0
+        for key in range(1, 100):  # ascending keys, single left rotations only
+            promotes += tree.insert(key, key)[2]
+        edges = [tree.search(key)[1] for key in range(1, 100)]
+        snapshot = stats.snapshot(reset=True)
+        self.assertEqual(snapshot["promotes"]["insert"], promotes)
+        self.assertGreater(snapshot["single_rotations"]["insert"], 0)
+        self.assertEqual(snapshot["double_rotations"]["insert"], 0)
+        paths = {}
+        for e in edges:
+            paths[e] = paths.get(e, 0) + 1
+        self.assertEqual(snapshot["search_path_lengths"], paths)
+        self.assertEqual(stats.snapshot()["search_path_lengths"], {})
+        tree.disable_stats()
+        tree.search(1)
+        self.assertEqual(stats.snapshot()["search_path_lengths"], {})
+
+    def test_split_records_its_joins(self):
+        tree = AVLTree()
+        for key in range(1000):
+            tree.insert(key, key)
+        stats = tree.enable_stats()
+        smaller, bigger = tree.split(tree.search(500)[0])
+        snapshot = stats.snapshot()
+        pieces = sum(count * number for count, number in snapshot["split_pieces"].items())
+        self.assertEqual(sum(snapshot["split_pieces"].values()), 1)
+        self.assertEqual(sum(snapshot["join_height_diffs"].values()), pieces)
+        self.assertEqual(smaller.size() + bigger.size(), 999)
+
+
+class AggregateTest(unittest.TestCase):
+    def test_range_sums_match_brute_force(self):
+        rng = random.Random(17)
+        tree = AVLTree()
+        tree.enable_aggregate(operator.add, 0)
+        ref = {}
+        for _ in range(1500):
+            key = rng.randrange(300)
+            op = rng.random()
+            if key not in ref and op < 0.5:
+                ref[key] = rng.randrange(-50, 50)
+                tree.insert(key, ref[key])
+            elif key in ref and op < 0.8:
+                tree.delete(tree.search(key)[0])
+                del ref[key]
+            elif key in ref:
+                ref[key] = rng.randrange(-50, 50)
+                tree.set_value(tree.search(key)[0], ref[key])
+            lo, hi = sorted(rng.sample(range(-5, 305), 2))
+            self.assertEqual(tree.aggregate(lo, hi), sum(v for k, v in ref.items() if lo <= k < hi))
+        self.assertEqual(tree.aggregate(), sum(ref.values()))
+        self.assertEqual(tree.aggregate(None, 150), sum(v for k, v in ref.items() if k < 150))
+        self.assertEqual(tree.aggregate(150, None), sum(v for k, v in ref.items() if k >= 150))
+        self.assertEqual(tree.aggregate(7, 7), 0)
+
+    def test_join_with_a_tree_without_aggregates(self):
+        tree = AVLTree.from_sorted([(key, key) for key in range(10)])
+        tree.enable_aggregate(operator.add, 0)
+        plain = AVLTree.from_sorted([(key, key) for key in range(20, 40)])
+        tree.join(plain, 15, 15)
+        tree.validate()
+        self.assertEqual(tree.aggregate(), sum(range(10)) + 15 + sum(range(20, 40)))
+        self.assertEqual(tree.aggregate(5, 25), sum(range(5, 10)) + 15 + sum(range(20, 25)))
+
+        intervals = IntervalAVLTree()
+        intervals.add(1, 3, "a")
+        intervals.add(2, 4, "b")
+        plain = AVLTree()
+        plain.insert((10, 50), "c")
+        plain.insert((12, 13), "d")
+        intervals.join(plain, (5, 6), "e")
+        self.assertEqual(list(intervals.stab(20)), [(10, 50, "c")])
+        self.assertEqual(list(intervals.overlapping(3, 12)), [(2, 4, "b"), (5, 6, "e"), (10, 50, "c")])
+
+
+class CacheTest(unittest.TestCase):
+    def test_capacity_must_be_positive(self):
+        for policy in ("lru", "clock"):
+            self.assertRaises(ValueError, AVLTree().enable_cache, 0, policy)
+            tree = AVLTree()
+            tree.enable_cache(1, policy)
+            tree.insert(1, "a")
+            tree.insert(2, "b")
+            self.assertEqual(tree.search(1)[0].value, "a")
+            self.assertEqual(tree.search(2)[0].value, "b")
+
+
+class BlockedAVLTreeTest(unittest.TestCase):
+    class Small(BlockedAVLTree):
+        BLOCK_SIZE = 4  # small blocks, so splits and merges happen often
+
+    def assertMatches(self, blocked, avl):
+        self.assertEqual(blocked.size(), avl.size())
+        self.assertEqual(list(blocked.items()), list(avl.items()))
+        for k in range(avl.size() + 2):
+            node, expected = blocked.select(k), avl.select(k)
+            self.assertEqual(None if node is None else node.key, None if expected is None else expected.key)
+        for key in range(-2, 402):
+            self.assertEqual(blocked.rank(key), avl.rank(key))
+            for search in ("search", "finger_search"):
+                node, expected = getattr(blocked, search)(key)[0], getattr(avl, search)(key)[0]
+                self.assertEqual(None if node is None else (node.key, node.value),
+                                 None if expected is None else (expected.key, expected.value))
+
+    def test_matches_avl_tree(self):
+        rng = random.Random(21)
+        avl = AVLTree()
+        for key in rng.sample(range(400), 200):
+            avl.insert(key, str(key))
+        blocked = self.Small.from_tree(avl)
+        self.assertMatches(blocked, avl)
+        for _ in range(600):
+            key = rng.randrange(400)
+            if avl.search(key)[0] is None:
+                self.assertEqual(blocked.insert(key, str(key)).key, key)
+                avl.insert(key, str(key))
+            else:
+                self.assertTrue(blocked.delete_key(key))
+                avl.delete(avl.search(key)[0])
+        self.assertMatches(blocked, avl)
+        self.assertFalse(blocked.delete_key(-1))
+
+
+class KeyedAVLTreeTest(unittest.TestCase):
+    def test_typed_keys(self):
+        tree = KeyedAVLTree(keytype=bytes)
+        for key in (b"b", b"a", b"c"):
+            tree.insert(key, key.upper())
+        self.assertRaises(TypeError, tree.insert, "d", "D")
+        self.assertEqual(tree.search(b"c")[0].value, b"C")
+        self.assertIsNone(tree.search(b"d")[0])
+        self.assertEqual(list(tree.range(b"b")), [(b"b", b"B"), (b"c", b"C")])
+        self.assertEqual(tree.rank(b"c"), tree.tree.rank(b"c"))
+
+    def test_key_function_and_comparator(self):
+        for tree in (KeyedAVLTree(key=lambda k: -k), KeyedAVLTree(cmp=lambda a, b: b - a)):
+            for key in (3, 1, 2):
+                tree.insert(key, str(key))
+            self.assertEqual(list(tree.keys()), [3, 2, 1])
+            self.assertEqual(tree.key_of(tree.search(2)[0]), 2)
+
+
+class IntervalAVLTreeTest(unittest.TestCase):
+    def test_value_aggregates_are_refused(self):
+        tree = IntervalAVLTree()
+        tree.add(1, 9, 3)
+        tree.add(2, 4, 1)
+        self.assertRaises(TypeError, tree.aggregate)
+        self.assertRaises(TypeError, tree.enable_aggregate, max, None)
+        self.assertEqual(list(tree.stab(5)), [(1, 9, 3)])
+
+
+class ConcurrentAVLTreeTest(unittest.TestCase):
+    def test_threads_in_both_lock_modes(self):
+        for shared in (False, True):
+            tree = ConcurrentAVLTree(shared_reads=shared)
+
+            def work(start):
+                for key in range(start, 4000, 4):
+                    tree.insert(key, key)
+                    self.assertEqual(tree.search(key)[0].value, key)
+                for key in range(start, 4000, 8):
+                    self.assertTrue(tree.delete(key))
+
+            threads = [threading.Thread(target=work, args=(start,)) for start in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with tree.read() as inner:
+                inner.validate()
+            self.assertEqual(tree.size(), 2000)
+            self.assertLessEqual(tree.batches, 6000)
+
+
+class DumpTest(unittest.TestCase):
+    def test_dump_load_and_map(self):
+        rng = random.Random(10)
+        values = [None, "text", b"bytes", ("a", 1), 2.5]
+        items = sorted((key, rng.choice(values)) for key in rng.sample(range(-10 ** 12, 10 ** 12), 1000))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tree.avl")
+            AVLTree.from_sorted(items).dump(path)
+            loaded = AVLTree.load(path)
+            loaded.validate()
+            self.assertEqual(loaded.avl_to_array(), items)
+            with MappedAVLTree(path) as mapped:
+                self.assertEqual(mapped.size(), len(items))
+                self.assertEqual(list(mapped.items()), items)
+                for key, value in items[::37]:
+                    node = mapped.search(key)[0]
+                    self.assertEqual((node.key, node.value), (key, value))
+                self.assertIsNone(mapped.search(10 ** 12)[0])
+                self.assertEqual(mapped.select(500).key, items[499][0])
+                self.assertEqual(list(mapped.range(items[10][0], items[20][0])), items[10:20])
+            empty = os.path.join(directory, "empty.avl")
+            AVLTree().dump(empty)
+            self.assertEqual(AVLTree.load(empty).avl_to_array(), [])
+            with open(empty, "wb"):
+                pass
+            self.assertRaises(ValueError, MappedAVLTree, empty)
+
+
+class DurableAVLTreeTest(unittest.TestCase):
+    def test_recover_keeps_foreign_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with DurableAVLTree(directory) as tree:
+                for key in range(10):
+                    tree.insert(key, str(key))
+                tree.checkpoint()
+                tree.insert(10, "10")
+            with open(os.path.join(directory, "README.txt"), "w") as f:
+                f.write("notes")
+            os.mkdir(os.path.join(directory, "backup"))
+            open(os.path.join(directory, "checkpoint-0"), "wb").close()
+            open(os.path.join(directory, "checkpoint-2.tmp"), "wb").close()
+            with DurableAVLTree(directory) as tree:
+                self.assertEqual([key for key, value in tree.avl_to_array()], list(range(11)))
+            self.assertEqual(sorted(os.listdir(directory)), ["README.txt", "backup", "checkpoint-1", "wal-1"])
+
+
+class PersistentAVLTreeTest(unittest.TestCase):
+    def test_snapshots_keep_their_version(self):
+        rng = random.Random(8)
+        tree = PersistentAVLTree()
+        expected = {}
+        versions = []
+        for step in range(30):
+            for key in rng.sample(range(1000), 20):
+                if key in expected:
+                    tree.delete(tree.search(key)[0])
+                    del expected[key]
+                else:
+                    tree.insert(key, step)
+                    expected[key] = step
+            versions.append((tree.snapshot(), sorted(expected.items())))
+        for snapshot, items in versions:
+            self.assertEqual(snapshot.avl_to_array(), items)
+        snapshot = versions[0][0]
+        self.assertRaises(TypeError, snapshot.insert, 5000, 0)
+        self.assertRaises(TypeError, snapshot.delete, snapshot.search(versions[0][1][0][0])[0])
+
+    def test_join_with_empty_tree(self):
+        for key, expected in ((1, [1, 5, 6, 7]), (9, [5, 6, 7, 9])):
+            tree = PersistentAVLTree()
+            for k in (5, 6, 7):
+                tree.insert(k, str(k))
+            tree.join(PersistentAVLTree(), key, str(key))
+            self.assertEqual([k for k, v in tree.avl_to_array()], expected)
+            empty = PersistentAVLTree()
+            empty.join(tree, 0, "0")
+            self.assertEqual([k for k, v in empty.avl_to_array()], [0] + expected)
+
+
+if __name__ == "__main__":
+    unittest.main()